@@ -1,9 +1,25 @@
+from startup import StartupTrace, NullTrace
+
+# Created before other imports to measure them too
+startup_trace = StartupTrace()
+
+import argparse
+import asyncio
 import sys
+import time
 
 import pygame
 
-from resources import ResourceManager
-from scenes import MenuScene
+import metrics
+import tasks
+from capture import FrameRecorder
+from netcode import NetworkScene, parse_address
+from performance import governor
+from resources import DEFAULT_BUDGET, ResourceManager
+from scenes import MenuScene, SceneManager
+from spectator import DEFAULT_NAME, StatePublisher
+
+startup_trace.mark('imports')
 
 
 def create_window(size, caption):
@@ -13,6 +29,23 @@ def create_window(size, caption):
     return surface                      # Возвращаем основную поверхность созданного окна
 
 
+def init_pygame(fast_start):
+    """Initializes pygame modules.
+
+    Args:
+        fast_start (bool): if True, only modules used by the game
+                           (display, font, mixer) are initialized.
+                           Otherwise `pygame.init()` initializes every module,
+                           including joysticks, camera etc.
+    """
+    if fast_start:
+        pygame.display.init()
+        pygame.font.init()
+        pygame.mixer.init()
+    else:
+        pygame.init()
+
+
 class Game:
     """Controls main game loop (handles events + draws all game objects).  
     In every iteration it checks which scene is active
@@ -23,16 +56,84 @@ class Game:
                                 the way it should be handled in current scene
         update():               to update all objects' state
         draw():                 to blit every object from current scene
+
+    The loop can be started in 2 ways:
+        game.run():                     regular blocking loop
+        asyncio.run(game.run_async()):  runs scenes' background tasks
+                                        (see `tasks.py`) between frames
     """
-    def __init__(self, size, fps=60):
-        pygame.init()
+    def __init__(self, size, fps=60, fast_start=True, trace=None, capture=None, publish_state=None,
+                 adaptive_quality=True, metrics_file=None, metrics_port=None, report_transitions=False,
+                 asset_budget=DEFAULT_BUDGET, report_assets=False):
+        """
+        Args:
+            size (Tuple[int]): window size.
+            fps (int)
+            fast_start (bool): initialize only necessary pygame modules
+                               and load resources in background, while menu is shown.
+            trace (StartupTrace): if passed, startup steps are measured and reported
+                                  after the first frame.
+            capture (str): if passed, every frame is recorded to this path,
+                           see `capture.create_writer`.
+            publish_state (str): if passed, positions of sprites are shared with other processes
+                                 after every frame in a shared memory block with this name,
+                                 see `spectator.py`.
+            adaptive_quality (bool): lower quality when frames don't fit into
+                                     the frame budget, see `performance.py`.
+            metrics_file (str): if passed, metrics are written to this file every few seconds.
+            metrics_port (int): if passed, metrics are served on `http://127.0.0.1:<port>/metrics`.
+            report_transitions (bool): print how long every scene transition takes.
+            asset_budget (int): bytes which loaded images and sounds may take, None means no limit.
+                                Assets which the shown scene doesn't use are evicted above it.
+            report_assets (bool): print memory taken by assets after every scene transition.
+        """
+        self.trace = trace or NullTrace()
+
+        with self.trace.step('pygame init'):
+            init_pygame(fast_start)
 
         self.FPS = fps
-        self.screen = create_window(size, 'Space Invaders')
-        self.resources = ResourceManager()
+        self.frame_budget = 1 / fps
+        if adaptive_quality:
+            governor.enable(fps)
+        with self.trace.step('window'):
+            self.screen = create_window(size, 'Space Invaders')
+        self.recorder = FrameRecorder(capture, self.screen) if capture else None
+        self.publisher = StatePublisher(publish_state) if publish_state else None
+        with self.trace.step('resources'):
+            self.resources = ResourceManager(lazy=fast_start, trace=self.trace, budget=asset_budget)
+        self.report_assets = report_assets
+
+        with self.trace.step('menu (fonts and text)'):
+            self.scenes = SceneManager(self.resources, verbose=report_transitions)
+            self.scene = self.scenes.get(MenuScene)
+            self.scenes.show(self.scene)
+
+        self.exporters = []
+        if metrics_file or metrics_port:
+            self.register_metrics()
+        if metrics_file:
+            self.exporters.append(metrics.FileExporter(metrics_file))
+        if metrics_port:
+            self.exporters.append(metrics.HTTPExporter(metrics_port))
+
+    def register_metrics(self):
+        """Gauges are read by the exporter thread, the main loop doesn't spend time on them.
+        """
+        groups = ('players', 'enemies', 'projectiles', 'explosion')
 
-        self.scene = MenuScene(self.resources)
-        self.run()
+        def count_sprites():
+            sprites = getattr(self.scene, 'sprites', None)
+            if sprites is None:
+                return dict.fromkeys(groups, 0)
+            return {group: len(getattr(sprites, group)) for group in groups}
+
+        metrics.register_gauge('live_sprites', 'Sprites alive in every group of SpriteManager.',
+                               count_sprites, label='group')
+        metrics.register_gauge('quality_level', 'Level of the performance governor, 0 is full quality.',
+                               lambda: governor.level)
+        metrics.register_gauge('resident_asset_bytes', 'Memory taken by loaded assets of every type.',
+                               self.resources.get_resident_bytes, label='type')
 
     def run(self, fps=60):
         # Necessary for FPS controling via `clock.tick()`
@@ -45,15 +146,69 @@ class Game:
             # Otherwise game will run to fast, up to 1.5k+ FPS.
             clock.tick(fps)
 
-            self.handle_events()
-            self.scene.update()
-            self.draw_content()
+            self.run_frame()
+
+    async def run_async(self, fps=60):
+        """Same as `run`, but waits for the next frame with `await`,
+        so background tasks of scenes can run in the meantime.
+        Tasks never run in the middle of `update` or `draw`.
+        """
+        loop = asyncio.get_running_loop()
+        frame_time = 1 / fps
+        deadline = loop.time()
+
+        while self.scene:
+            self.run_frame()
+
+            # If a frame took too long, the next one starts immediately,
+            # but the game doesn't try to catch up by running frames faster.
+            deadline = max(deadline + frame_time, loop.time())
+            await tasks.sleep_until(deadline)
+
+    def run_frame(self):
+        start = time.perf_counter()
+        self.handle_events()
+        self.scene.update()
+        self.draw_content()
+
+        frame_seconds = time.perf_counter() - start
+        governor.record(frame_seconds * 1000)
+        metrics.counters.frames += 1
+        metrics.counters.frame_seconds += frame_seconds
 
-            self.scene = self.scene.next_scene
+        if self.publisher:
+            self.publisher.publish(self.scene)
+
+        if self.trace.first_frame():
+            self.trace.report()
+
+        # In `fast_start` mode resources which weren't needed for the first frame
+        # are loaded one per frame, it does nothing when everything is loaded.
+        loaded = self.resources.load_pending()
+
+        next_scene = self.scene.next_scene
+        if next_scene is not self.scene:
+            self.scenes.switch(self.scene, next_scene, frame_seconds)
+            if self.report_assets:
+                self.resources.report()
+        elif not loaded and frame_seconds < self.frame_budget / 2:
+            # The frame has time left, so the next scene is prepared in advance
+            self.scenes.prewarm(self.scene)
+
+        self.scene = next_scene
 
     def handle_events(self):
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
+                if self.recorder:
+                    self.recorder.close()       # Waits until every recorded frame is saved
+                if self.publisher:
+                    self.publisher.close()
+                for exporter in self.exporters:
+                    exporter.close()
+                if self.scenes.verbose:
+                    self.scenes.report()
+                tasks.cancel_all()
                 sys.exit()
             else:
                 self.scene.handle_event(event)
@@ -64,7 +219,58 @@ class Game:
         # `update` actually displays every "blitted" object on surfaces
         pygame.display.update()
 
+        if self.recorder:
+            self.recorder.capture(self.screen)
+
 
 if __name__ == '__main__':
-    game = Game(size=(800, 600))
-    game.run(fps=60)
+    parser = argparse.ArgumentParser(description='Space Invaders')
+    parser.add_argument('--trace-startup', action='store_true',
+                        help='print duration of every startup step and time to first frame')
+    parser.add_argument('--full-init', action='store_true',
+                        help='initialize every pygame module and load every resource before the menu')
+    parser.add_argument('--capture', metavar='PATH',
+                        help='record gameplay to a raw video file (*.raw) or a directory of images')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='run the main loop in asyncio event loop')
+    parser.add_argument('--publish-state', nargs='?', const=DEFAULT_NAME, metavar='NAME',
+                        help='share game state with other processes, see spectator.py; '
+                             'pass a name to run several publishing games at once')
+    parser.add_argument('--fixed-quality', action='store_true',
+                        help="don't lower quality when the game runs slowly")
+    parser.add_argument('--metrics-file', metavar='PATH',
+                        help='write Prometheus metrics to this file every 5 seconds')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help='serve Prometheus metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--report-transitions', action='store_true',
+                        help='print how long every scene transition takes')
+    parser.add_argument('--asset-budget-mb', type=float, default=DEFAULT_BUDGET / 1024 / 1024,
+                        help='memory for loaded images and sounds, unused ones are evicted above it')
+    parser.add_argument('--report-assets', action='store_true',
+                        help='print memory taken by images and sounds after every scene transition')
+    parser.add_argument('--join', metavar='HOST:PORT',
+                        help='play co-op on a server started with `python netcode.py serve`')
+    args = parser.parse_args()
+
+    game = Game(
+        size=(800, 600),
+        fast_start=not args.full_init,
+        trace=startup_trace if args.trace_startup else None,
+        capture=args.capture,
+        publish_state=args.publish_state,
+        adaptive_quality=not args.fixed_quality,
+        metrics_file=args.metrics_file,
+        metrics_port=args.metrics_port,
+        report_transitions=args.report_transitions,
+        asset_budget=int(args.asset_budget_mb * 1024 * 1024),
+        report_assets=args.report_assets
+    )
+    if args.join:
+        network_scene = game.scenes.get(NetworkScene, parse_address(args.join))
+        game.scenes.switch(game.scene, network_scene)
+        game.scene = network_scene
+
+    if args.use_async:
+        asyncio.run(game.run_async(fps=60))
+    else:
+        game.run(fps=60)
@@ -0,0 +1,256 @@
+"""Texture atlas: every sprite image packed into one surface.
+
+Images are scaled for the current screen size, packed into a single
+surface and saved to `cache/` together with their positions.
+Next time the game starts, the whole atlas is loaded with one decode
+of a small file instead of decoding every large source image.
+
+Every image is a subsurface of the atlas, so it's blitted as usual
+and has its own mask. The cache is rebuilt automatically when
+source files, their sizes in `resources.IMAGE_FILES` or the screen size change.
+
+Build the atlas and compare memory with separate images:
+    python atlas.py
+"""
+import hashlib
+import json
+import os
+import time
+
+import pygame
+
+from resources import Image, IMAGE_FILES
+
+
+CACHE_DIR = 'cache'
+PADDING = 1             # Transparent pixels between images
+
+# Background is as large as the screen and doesn't have transparency,
+# so it's kept as a separate surface.
+EXCLUDED_IMAGES = ('bg',)
+ATLAS_IMAGES = tuple(name for name in IMAGE_FILES if name not in EXCLUDED_IMAGES)
+
+
+def pack(sizes, width):
+    """Places rects on shelves: rows of rects sorted by height.
+
+    Args:
+        sizes (dict): name -> (width, height).
+        width (int): width of the atlas.
+
+    Returns:
+        Tuple[dict, int]: name -> (x, y) and height of the atlas.
+    """
+    positions = {}
+    x = y = shelf_height = 0
+    for name in sorted(sizes, key=lambda name: sizes[name][1], reverse=True):
+        w, h = sizes[name]
+        if x + w > width:
+            x = 0
+            y += shelf_height + PADDING
+            shelf_height = 0
+
+        positions[name] = (x, y)
+        x += w + PADDING
+        shelf_height = max(shelf_height, h)
+
+    return positions, y + shelf_height
+
+
+def pack_smallest(sizes, step=8):
+    """Tries every width from the widest image to a single row
+    and returns the packing with the smallest area.
+    Software surfaces don't need power of 2 sizes.
+
+    Returns:
+        Tuple[dict, Tuple[int]]: name -> (x, y) and size of the atlas.
+    """
+    widest = max(w for w, _ in sizes.values())
+    row = sum(w + PADDING for w, _ in sizes.values())
+
+    best = None
+    for width in range(widest, row + step, step):
+        positions, height = pack(sizes, width)
+        if best is None or width * height < best[1][0] * best[1][1]:
+            best = positions, (width, height)
+
+    return best
+
+
+def get_cache_key(screen_size):
+    """Changes when anything which affects the atlas changes.
+    """
+    sources = []
+    for name in ATLAS_IMAGES:
+        filename, width, height = IMAGE_FILES[name]
+        path = os.path.join('img', filename)
+        try:
+            stat = os.stat(path)
+            file_info = (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            file_info = None
+        sources.append((name, filename, width, height, file_info))
+
+    data = json.dumps([list(screen_size), sources, PADDING])
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def get_surface_bytes(surface):
+    return surface.get_pitch() * surface.get_height()
+
+
+class TextureAtlas:
+    """One surface with every sprite image.
+
+    Attributes:
+        surface (pygame.Surface): the whole atlas.
+        images (dict): name -> `resources.Image` with a subsurface of the atlas.
+        regions (dict): name -> (x, y, width, height).
+        from_cache (bool): whether the atlas was loaded from `cache/`.
+    """
+    def __init__(self, surface, regions, from_cache):
+        self.surface = surface
+        self.regions = regions
+        self.from_cache = from_cache
+        self.images = {
+            name: Image.from_surface(surface.subsurface(region))
+            for name, region in regions.items()
+        }
+
+    @classmethod
+    def load(cls, cache_dir=CACHE_DIR):
+        """Loads the atlas from cache or builds it if the cache is missing or outdated.
+        """
+        screen_size = pygame.display.get_window_size()
+        key = get_cache_key(screen_size)
+        image_path = os.path.join(cache_dir, f'atlas_{key[:16]}.png')
+        layout_path = os.path.join(cache_dir, f'atlas_{key[:16]}.json')
+
+        try:
+            with open(layout_path) as file:
+                layout = json.load(file)
+            if layout['key'] == key:
+                surface = pygame.image.load(image_path).convert_alpha()
+                regions = {name: tuple(region) for name, region in layout['regions'].items()}
+                return cls(surface, regions, from_cache=True)
+        except (OSError, ValueError, KeyError, pygame.error):
+            pass                # Cache is missing or broken, it's rebuilt
+
+        atlas = cls.build()
+        try:
+            atlas.save(cache_dir, image_path, layout_path, key)
+        except OSError as error:
+            # The cache only speeds up the next start, the built atlas works without it
+            print(f'Can not save texture atlas to {cache_dir}: {error}')
+        return atlas
+
+    @classmethod
+    def build(cls):
+        """Loads and scales every image from its file and packs them into one surface.
+        """
+        images = load_separate_images()
+        sizes = {name: image.img.get_size() for name, image in images.items()}
+        positions, size = pack_smallest(sizes)
+
+        surface = pygame.Surface(size, pygame.SRCALPHA)
+        regions = {}
+        for name, image in images.items():
+            x, y = positions[name]
+            # MAX blending over transparent black copies pixels exactly,
+            # regular alpha blending would darken semi-transparent edges
+            surface.blit(image.img, (x, y), special_flags=pygame.BLEND_RGBA_MAX)
+            regions[name] = (x, y) + sizes[name]
+
+        return cls(surface.convert_alpha(), regions, from_cache=False)
+
+    def save(self, cache_dir, image_path, layout_path, key):
+        """Writes the atlas to temporary files first, so another process
+        (e.g. a worker of `balancing.py`) never reads a half-written atlas.
+
+        Several processes may build the same atlas at once: each of them
+        writes its own temporary files and only removes atlases of other keys.
+
+        Raises:
+            OSError: if the cache can't be written.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        current = f'atlas_{key[:16]}'
+        for old in os.listdir(cache_dir):
+            if old.startswith('atlas_') and not old.startswith(current):
+                try:
+                    os.remove(os.path.join(cache_dir, old))
+                except FileNotFoundError:
+                    pass        # Removed by another process
+
+        temp_image = f'{image_path}.{os.getpid()}.tmp.png'
+        pygame.image.save(self.surface, temp_image)
+        os.replace(temp_image, image_path)
+
+        temp_layout = f'{layout_path}.{os.getpid()}.tmp'
+        with open(temp_layout, 'w') as file:
+            json.dump({'key': key, 'regions': self.regions}, file)
+        os.replace(temp_layout, layout_path)
+
+    def get_size_bytes(self):
+        return get_surface_bytes(self.surface)
+
+    def get_fill(self):
+        """Share of the atlas covered by images.
+        """
+        used = sum(w * h for _, _, w, h in self.regions.values())
+        width, height = self.surface.get_size()
+        return used / (width * height)
+
+
+def load_separate_images():
+    """Loads sprite images the way `ResourceManager` does without the atlas.
+    """
+    screen_width, screen_height = pygame.display.get_window_size()
+    images = {}
+    for name in ATLAS_IMAGES:
+        filename, width, height = IMAGE_FILES[name]
+        images[name] = Image(filename, screen_width * width, screen_height * height)
+
+    return images
+
+
+def get_decoded_bytes():
+    """Memory needed to decode every source file at its original size.
+    """
+    total = 0
+    for name in ATLAS_IMAGES:
+        path = os.path.join('img', IMAGE_FILES[name][0])
+        if os.path.exists(path):
+            total += get_surface_bytes(pygame.image.load(path))
+
+    return total
+
+
+def report(atlas, file=None):
+    """Prints memory taken by separate images and by the atlas.
+    """
+    separate = load_separate_images()
+    separate_bytes = sum(get_surface_bytes(image.img) for image in separate.values())
+    width, height = atlas.surface.get_size()
+
+    print(f'Images: {len(separate)} ({", ".join(separate)})', file=file)
+    print(f'Separate surfaces:  {len(separate)} surfaces, {separate_bytes / 1024:.1f} KiB, '
+          f'{get_decoded_bytes() / 1024:.1f} KiB decoded from source files', file=file)
+    if atlas.from_cache:
+        source = f'{atlas.get_size_bytes() / 1024:.1f} KiB decoded from cache'
+    else:
+        source = 'built from source files, cache created'
+    print(f'Atlas:              1 surface {width}x{height}, {atlas.get_size_bytes() / 1024:.1f} KiB '
+          f'({atlas.get_fill():.0%} filled), {source}', file=file)
+
+
+if __name__ == '__main__':
+    # Atlas depends on the screen size, but a real window isn't needed
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    pygame.display.set_mode((800, 600))
+
+    start = time.perf_counter()
+    atlas = TextureAtlas.load()
+    print(f'Atlas loaded in {(time.perf_counter() - start) * 1000:.1f} ms.')
+    report(atlas)
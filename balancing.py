@@ -0,0 +1,223 @@
+"""Monte Carlo balancing of difficulty presets.
+
+Plays a lot of headless games with a scripted bot
+for every combination of game parameters and reports
+survival time and score distributions.
+
+Example:
+    python balancing.py --difficulty 1 --games 200 \\
+        --param enemy_velocity=1,2,3 --param shoot_cost=30,35,40 \\
+        --output sweep.jsonl
+
+Every finished game is appended to `--output` immediately,
+so an interrupted sweep continues from where it stopped
+when the same command is run again.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import statistics
+
+import headless
+
+
+# Worker process state, created once per process by `init_worker`
+_worker = {}
+
+
+def init_worker():
+    _worker['resources'] = headless.init_headless()
+    _worker['clock'] = headless.VirtualClock()
+    _worker['clock'].install()
+
+
+def run_task(task):
+    """Plays a single game in a worker process.
+
+    Args:
+        task (Tuple): (config key, difficulty, params, seed, max_seconds)
+
+    Returns:
+        dict: a result of `headless.play_game` with task description added.
+    """
+    key, difficulty, params, seed, max_seconds = task
+    random.seed(seed)
+
+    result = headless.play_game(
+        _worker['resources'],
+        _worker['clock'],
+        difficulty=difficulty,
+        params=params,
+        max_seconds=max_seconds
+    )
+    result.update(config=key, difficulty=difficulty, params=params, seed=seed)
+    return result
+
+
+def parse_param(text):
+    """Parses `name=1,2,3` into `('name', [1, 2, 3])`.
+    """
+    name, _, values = text.partition('=')
+    if not values:
+        raise argparse.ArgumentTypeError(f'Expected `name=value1,value2`, got `{text}`.')
+
+    return name, [int(value) for value in values.split(',')]
+
+
+def make_configs(grid, sample=0, seed=0):
+    """Creates parameter combinations.
+
+    Args:
+        grid (List[Tuple[str, List[int]]]): values for every parameter.
+        sample (int): if not 0, only `sample` random combinations are used
+                      instead of the whole grid.
+        seed (int): seed for random sampling.
+
+    Returns:
+        List[dict]
+    """
+    names = [name for name, _ in grid]
+    combinations = list(itertools.product(*(values for _, values in grid)))
+
+    if sample and sample < len(combinations):
+        combinations = random.Random(seed).sample(combinations, sample)
+
+    return [dict(zip(names, values)) for values in combinations]
+
+
+def config_key(difficulty, params, max_seconds):
+    """Games are grouped and resumed by this key,
+    so games with a different time limit are never mixed.
+    """
+    return json.dumps({'difficulty': difficulty, 'max_seconds': max_seconds, **params}, sort_keys=True)
+
+
+def load_results(path):
+    """Reads results of the previous runs.
+    A partially written last line (the sweep was killed) is ignored.
+    """
+    results = []
+    if not os.path.exists(path):
+        return results
+
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            try:
+                results.append(json.loads(line))
+            except json.JSONDecodeError:
+                pass
+
+    return results
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * pct / 100))
+    return values[index]
+
+
+def summarize(results):
+    """Aggregates results by configuration.
+
+    Returns:
+        List[dict]: one item per configuration, sorted by median survival time.
+    """
+    by_config = {}
+    for result in results:
+        by_config.setdefault(result['config'], []).append(result)
+
+    summary = []
+    for key, games in by_config.items():
+        survival = [game['survival'] for game in games]
+        score = [game['score'] for game in games]
+        summary.append({
+            'config': key,
+            'games': len(games),
+            'survived': sum(not game['finished'] for game in games),
+            'survival_median': statistics.median(survival),
+            'survival_p10': percentile(survival, 10),
+            'survival_p90': percentile(survival, 90),
+            'score_mean': statistics.mean(score),
+            'score_median': statistics.median(score),
+        })
+
+    summary.sort(key=lambda item: item['survival_median'])
+    return summary
+
+
+def print_summary(summary):
+    header = f'{"games":>6} {"alive":>6} {"surv p10":>9} {"surv p50":>9} {"surv p90":>9} {"score":>7}  config'
+    print(header)
+    for item in summary:
+        print(
+            f'{item["games"]:>6} {item["survived"]:>6} '
+            f'{item["survival_p10"]:>9.1f} {item["survival_median"]:>9.1f} {item["survival_p90"]:>9.1f} '
+            f'{item["score_mean"]:>7.1f}  {item["config"]}'
+        )
+
+
+def run_sweep(difficulty, grid, games, output, processes=None, sample=0, max_seconds=300, seed=0):
+    """Plays `games` games for every configuration and streams results to `output`.
+    Games which are already present in `output` are skipped.
+
+    Returns:
+        List[dict]: every result from `output`, including the previous runs.
+    """
+    results = load_results(output)
+    done = {(result['config'], result['seed']) for result in results}
+
+    tasks = []
+    for params in make_configs(grid, sample, seed):
+        key = config_key(difficulty, params, max_seconds)
+        for game in range(games):
+            game_seed = seed + game
+            if (key, game_seed) not in done:
+                tasks.append((key, difficulty, params, game_seed, max_seconds))
+
+    print(f'{len(done)} games already played, {len(tasks)} left.')
+    if not tasks:
+        return results
+
+    with multiprocessing.Pool(processes, initializer=init_worker) as pool, \
+            open(output, 'a', encoding='utf-8') as file:
+        for i, result in enumerate(pool.imap_unordered(run_task, tasks, chunksize=4), 1):
+            file.write(json.dumps(result) + '\n')
+            file.flush()
+            results.append(result)
+
+            if i % 100 == 0 or i == len(tasks):
+                print(f'{i}/{len(tasks)} games played.')
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Monte Carlo balancing of difficulty presets.')
+    parser.add_argument('--difficulty', type=int, default=1, choices=(0, 1, 2),
+                        help='preset which values are not overridden by --param')
+    parser.add_argument('--param', type=parse_param, action='append', default=[],
+                        help='values to try, e.g. enemy_velocity=1,2,3 (can be repeated)')
+    parser.add_argument('--games', type=int, default=100, help='games per configuration')
+    parser.add_argument('--sample', type=int, default=0,
+                        help='try only N random configurations from the grid')
+    parser.add_argument('--processes', type=int, default=None, help='defaults to CPU count')
+    parser.add_argument('--max-seconds', type=int, default=300, help='simulated length limit of a game')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='balancing.jsonl')
+    args = parser.parse_args()
+
+    results = run_sweep(
+        args.difficulty, args.param, args.games, args.output,
+        processes=args.processes,
+        sample=args.sample,
+        max_seconds=args.max_seconds,
+        seed=args.seed
+    )
+    print_summary(summarize(results))
+
+
+if __name__ == '__main__':
+    main()
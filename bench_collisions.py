@@ -0,0 +1,72 @@
+"""Benchmark of `groupcollide` with `pygame.sprite.collide_mask`
+and with `sprites.collide_hierarchy`.
+
+Places enemies and projectiles at random positions
+and checks collisions the same way `SpriteManager` does.
+
+Example:
+    python bench_collisions.py --enemies 30 --projectiles 60
+"""
+import argparse
+import random
+import timeit
+
+import pygame
+
+import headless
+from sprites import SpriteManager, collide_hierarchy
+
+
+def create_sprites(resources, enemies, projectiles, seed):
+    random.seed(seed)
+    params = {
+        'player_velocity': 5,
+        'player_cooldown': 100,
+        'player_energy': 600,
+        'enemy_velocity': 1,
+        'projectile_velocity': 5,
+    }
+    sprites = SpriteManager(params, resources)
+    width, height = pygame.display.get_window_size()
+
+    for _ in range(enemies):
+        enemy = sprites.create_enemy()
+        enemy.rect.y = random.randint(0, height)
+    for _ in range(projectiles):
+        sprites.restore_projectile((random.randint(0, width), random.randint(0, height)))
+
+    return sprites
+
+
+def run(resources, enemies, projectiles, rounds, seed=0):
+    sprites = create_sprites(resources, enemies, projectiles, seed)
+
+    def collide(collided):
+        return pygame.sprite.groupcollide(sprites.projectiles, sprites.enemies, False, False, collided)
+
+    # Both functions must find exactly the same collisions
+    expected = {p: set(e) for p, e in collide(pygame.sprite.collide_mask).items()}
+    actual = {p: set(e) for p, e in collide(collide_hierarchy).items()}
+    if expected != actual:
+        raise AssertionError('collide_hierarchy results differ from collide_mask.')
+
+    print(f'{enemies} enemies, {projectiles} projectiles, {len(expected)} colliding projectiles')
+    for collided in (pygame.sprite.collide_mask, collide_hierarchy):
+        seconds = min(timeit.repeat(lambda: collide(collided), number=rounds, repeat=5))
+        print(f'{collided.__name__:>20}: {seconds / rounds * 1e6:8.1f} us per groupcollide')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of collision detection.')
+    parser.add_argument('--enemies', type=int, nargs='+', default=[10, 30, 100])
+    parser.add_argument('--projectiles', type=int, default=60)
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    resources = headless.init_headless()
+    for enemies in args.enemies:
+        run(resources, enemies, args.projectiles, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
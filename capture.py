@@ -0,0 +1,310 @@
+"""Recording of gameplay without slowing down the main loop.
+
+`FrameRecorder.capture()` only copies raw pixels of the screen
+into one of preallocated shared memory buffers (a plain memory copy).
+Frames are saved by a separate process, so even slow `.png` encoding
+doesn't take time (or GIL) from the game.
+If the process can't keep up, new frames are dropped instead of waiting for it.
+
+Frames are saved either to a raw video file (`.raw`, fastest)
+or to a directory as a sequence of `.png` images.
+Raw video can be converted to images later:
+    python capture.py gameplay.raw frames/
+"""
+import mmap
+import multiprocessing
+import os
+import queue
+import struct
+import sys
+from multiprocessing import shared_memory
+
+import pygame
+
+
+def get_frame_format(surface):
+    """Describes raw pixels of `surface`, enough to create a surface from them later.
+    """
+    return {
+        'size': surface.get_size(),
+        'pitch': surface.get_pitch(),
+        'bitsize': surface.get_bitsize(),
+        'masks': surface.get_masks(),
+    }
+
+
+def frame_to_surface(frame, frame_format):
+    """Creates a surface from raw pixels copied by `FrameRecorder`.
+
+    Args:
+        frame (bytes, bytearray, memoryview): raw pixels.
+        frame_format (dict): result of `get_frame_format`.
+    """
+    image = pygame.Surface(frame_format['size'], 0, frame_format['bitsize'], frame_format['masks'])
+    with memoryview(image.get_buffer()) as pixels:
+        pixels[:] = frame
+
+    return image
+
+
+class RawVideoWriter:
+    """Writes frames one after another into a memory-mapped file.
+
+    File layout:
+        header:     magic, width, height, pitch, bits per pixel,
+                    amount of frames, RGBA masks of pixel format
+        frames:     raw pixels of every frame, `pitch * height` bytes each
+
+    The file grows by `chunk_frames` frames when it's full
+    and is cut to the real amount of frames on `close()`.
+    """
+    MAGIC = b'IVRW'
+    header = struct.Struct('=4sIIIII4I')
+
+    def __init__(self, path, frame_format, max_frames=0, chunk_frames=600):
+        """
+        Args:
+            path (str)
+            frame_format (dict): result of `get_frame_format`.
+            max_frames (int): frames after this limit are dropped, 0 means no limit.
+            chunk_frames (int): how many frames are added to the file when it's full.
+        """
+        self.format = frame_format
+        self.frame_size = frame_format['pitch'] * frame_format['size'][1]
+        self.max_frames = max_frames
+        self.chunk_frames = chunk_frames
+        self.capacity = 0
+        self.frames = 0
+
+        self.file = open(path, 'w+b')
+        self.map = None
+        self.grow()
+
+    def grow(self):
+        """Makes room for `chunk_frames` more frames and maps the file again.
+        """
+        if self.map:
+            self.map.close()
+
+        self.capacity += self.chunk_frames
+        self.file.truncate(self.header.size + self.frame_size * self.capacity)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def write(self, frame):
+        """
+        Args:
+            frame (memoryview): raw pixels in the format of the captured surface.
+
+        Returns:
+            bool: False if `max_frames` is reached and frame wasn't written.
+        """
+        if self.max_frames and self.frames == self.max_frames:
+            return False
+        if self.frames == self.capacity:
+            self.grow()
+
+        start = self.header.size + self.frames * self.frame_size
+        self.map[start:start + self.frame_size] = frame
+        self.frames += 1
+        return True
+
+    def close(self):
+        width, height = self.format['size']
+        self.header.pack_into(
+            self.map, 0,
+            self.MAGIC, width, height, self.format['pitch'], self.format['bitsize'],
+            self.frames, *self.format['masks']
+        )
+        self.map.close()
+        self.file.truncate(self.header.size + self.frames * self.frame_size)
+        self.file.close()
+
+
+class ImageSequenceWriter:
+    """Saves every frame as `frame_000000.png`, `frame_000001.png` etc.
+    Much slower than `RawVideoWriter`, but doesn't need conversion.
+    """
+    def __init__(self, directory, frame_format):
+        self.directory = directory
+        self.format = frame_format
+        self.frames = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, frame):
+        image = frame_to_surface(frame, self.format)
+        pygame.image.save(image, os.path.join(self.directory, f'frame_{self.frames:06d}.png'))
+        self.frames += 1
+        return True
+
+    def close(self):
+        pass
+
+
+def create_writer(path, frame_format):
+    """Raw video if path ends with `.raw`, otherwise a directory with images.
+    """
+    if path.endswith('.raw'):
+        return RawVideoWriter(path, frame_format)
+
+    return ImageSequenceWriter(path, frame_format)
+
+
+def write_frames(path, frame_format, memory_name, returned, filled, overflow):
+    """Runs in the writer process until `None` is received from `filled`.
+
+    Args:
+        path (str): where to write frames, see `create_writer`.
+        frame_format (dict)
+        memory_name (str): name of shared memory with frame buffers.
+        returned (multiprocessing.Queue): indexes of written buffers, returned to the game.
+        filled (multiprocessing.Queue): indexes of buffers to be written.
+        overflow (multiprocessing.Value): frames rejected by the writer.
+    """
+    writer = create_writer(path, frame_format)
+    memory = shared_memory.SharedMemory(memory_name)
+    frame_size = frame_format['pitch'] * frame_format['size'][1]
+
+    while True:
+        index = filled.get()
+        if index is None:
+            break
+
+        with memory.buf[index * frame_size:(index + 1) * frame_size] as frame:
+            if not writer.write(frame):
+                overflow.value += 1
+
+        returned.put(index)
+
+    writer.close()
+    memory.close()
+
+
+class FrameRecorder:
+    """Copies frames into a ring of preallocated shared memory buffers
+    and passes them to a writer in a separate process.
+
+    Example:
+        recorder = FrameRecorder('gameplay.raw', screen)
+        ...
+        recorder.capture(screen)    # After every `pygame.display.update()`
+        ...
+        recorder.close()            # Waits for the writer and prints a report
+    """
+    def __init__(self, path, surface, buffers=8):
+        """
+        Args:
+            path (str): `.raw` file or a directory for images.
+            surface (pygame.Surface): the surface which will be captured.
+            buffers (int): how many frames can wait for the writer.
+                           If all buffers are busy, new frames are dropped.
+        """
+        frame_format = get_frame_format(surface)
+        self.frame_size = frame_format['pitch'] * frame_format['size'][1]
+        self.memory = shared_memory.SharedMemory(create=True, size=self.frame_size * buffers)
+
+        # Indexes of buffers which can be filled with a new frame
+        self.free = list(range(buffers))
+
+        # `spawn` is the same on every platform and doesn't copy SDL state of the game
+        context = multiprocessing.get_context('spawn')
+        # Indexes of buffers which were written and returned by the writer
+        self.returned = context.Queue()
+        # Indexes of filled buffers, waiting for the writer
+        self.filled = context.Queue()
+        self.overflow = context.Value('i', 0)
+
+        self.captured = 0
+        self.dropped = 0
+
+        self.process = context.Process(
+            target=write_frames,
+            args=(path, frame_format, self.memory.name, self.returned, self.filled, self.overflow),
+            daemon=True
+        )
+        self.process.start()
+
+    def capture(self, surface):
+        """Copies current content of `surface`.
+        Never waits: if there is no free buffer, the frame is dropped.
+
+        Returns:
+            bool: False if the frame was dropped.
+        """
+        # Collecting buffers which the writer has already saved
+        try:
+            while True:
+                self.free.append(self.returned.get_nowait())
+        except queue.Empty:
+            pass
+
+        if self.free:
+            index = self.free.pop()
+        else:
+            if not self.dropped:
+                print('Capture: writer is too slow, frames are being dropped.')
+            self.dropped += 1
+            return False
+
+        # Copying raw pixels is just a memory copy, much faster than any image conversion
+        start = index * self.frame_size
+        with memoryview(surface.get_buffer()) as pixels:
+            self.memory.buf[start:start + self.frame_size] = pixels
+
+        self.captured += 1
+        self.filled.put(index)
+        return True
+
+    def close(self):
+        """Waits until every captured frame is written,
+        stops the writer process and prints a report.
+        """
+        self.filled.put(None)
+        self.process.join()
+        self.memory.close()
+        self.memory.unlink()
+        self.report()
+
+    def report(self, file=None):
+        file = file or sys.stdout
+        dropped = self.dropped + self.overflow.value
+        written = self.captured - self.overflow.value
+        dropped_pct = dropped / (written + dropped) * 100 if written + dropped else 0
+        print(f'Capture: {written} frames written, {dropped} dropped ({dropped_pct:.1f}%).', file=file)
+
+
+def read_raw_video(path):
+    """Reads frames from a file written by `RawVideoWriter`.
+
+    Yields:
+        pygame.Surface
+    """
+    header = RawVideoWriter.header
+    with open(path, 'rb') as file:
+        magic, width, height, pitch, bitsize, frames, *masks = header.unpack(file.read(header.size))
+        if magic != RawVideoWriter.MAGIC:
+            raise ValueError(f'{path} is not a raw video file.')
+
+        frame_format = {'size': (width, height), 'pitch': pitch, 'bitsize': bitsize, 'masks': masks}
+        for _ in range(frames):
+            yield frame_to_surface(file.read(pitch * height), frame_format)
+
+
+def convert_raw_video(path, directory):
+    """Saves every frame of a raw video as an image.
+    """
+    os.makedirs(directory, exist_ok=True)
+    frames = 0
+    for image in read_raw_video(path):
+        pygame.image.save(image, os.path.join(directory, f'frame_{frames:06d}.png'))
+        frames += 1
+
+    print(f'{frames} frames saved to {directory}.')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python capture.py VIDEO.raw OUTPUT_DIRECTORY')
+        sys.exit(1)
+
+    convert_raw_video(sys.argv[1], sys.argv[2])
@@ -0,0 +1,187 @@
+import os
+
+import pygame
+
+from constants import EVENT_SPAWN_ENEMY
+from resources import ResourceManager
+from scenes import MainScene
+
+
+def init_headless(size=(800, 600)):
+    """Initializes pygame without a real window and sound card.
+    Must be called before any other pygame call in the process.
+
+    Returns:
+        ResourceManager
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    # Otherwise SDL catches SIGTERM and such process can't be stopped
+    # by `multiprocessing.Pool.terminate()`
+    os.environ.setdefault('SDL_NO_SIGNAL_HANDLERS', '1')
+
+    pygame.init()
+    pygame.display.set_mode(size)
+
+    return ResourceManager()
+
+
+class VirtualClock:
+    """Replaces `pygame.time.get_ticks` and `pygame.time.set_timer`
+    with a clock which moves only when `advance` is called.
+
+    That allows to simulate a game much faster than in real time:
+    cooldowns, spawn timers and explosions behave exactly
+    as if every frame took `1000 / fps` ms.
+    """
+    def __init__(self):
+        self.ticks = 0.0
+        self.timers = {}        # event type -> [next fire time, interval]
+
+    def install(self):
+        pygame.time.get_ticks = self.get_ticks
+        pygame.time.set_timer = self.set_timer
+
+    def reset(self):
+        self.ticks = 0.0
+        self.timers.clear()
+
+    def get_ticks(self):
+        return int(self.ticks)
+
+    def set_timer(self, event, millis, loops=0):
+        """Same signature as `pygame.time.set_timer`,
+        `loops` is ignored: every timer repeats until it's re-set.
+        """
+        if isinstance(event, pygame.event.EventType):
+            event = event.type
+
+        if millis <= 0:
+            self.timers.pop(event, None)
+        else:
+            self.timers[event] = [self.ticks + millis, millis]
+
+    def advance(self, ms):
+        """Moves the clock forward and posts events of every timer which has fired.
+        """
+        self.ticks += ms
+        for event_type, timer in self.timers.items():
+            while timer[0] <= self.ticks:
+                pygame.event.post(pygame.event.Event(event_type))
+                timer[0] += timer[1]
+
+
+class Bot:
+    """Scripted player.
+    Flies under the lowest enemy and shoots when it's aligned with it,
+    moves aside when an enemy is about to hit the ship.
+    """
+    def __init__(self, aim_tolerance=8, danger_distance=120):
+        """
+        Args:
+            aim_tolerance (int): max horizontal distance (px) to enemy to start shooting.
+            danger_distance (int): vertical distance (px) at which bot starts to dodge.
+        """
+        self.aim_tolerance = aim_tolerance
+        self.danger_distance = danger_distance
+
+    def act(self, scene):
+        """Moves player's ship and shoots.
+        Called once per frame before `scene.update()`.
+
+        Args:
+            scene (MainScene)
+        """
+        player = scene.player.rect
+        enemies = scene.sprites.enemies.sprites()
+        if not enemies:
+            return
+
+        # The lowest enemy is the most dangerous one
+        target = max(enemies, key=lambda enemy: enemy.rect.bottom).rect
+        dx = target.centerx - player.centerx
+
+        about_to_hit = (
+            player.top - target.bottom < self.danger_distance
+            and abs(dx) < (player.width + target.width) / 2
+        )
+        if about_to_hit:
+            # Move away from the enemy, unless the ship is stuck at the screen border
+            go_right = dx < 0
+            if player.right >= scene.width - player.width:
+                go_right = False
+            elif player.left <= player.width:
+                go_right = True
+            scene.player.move('right' if go_right else 'left')
+        elif dx > self.aim_tolerance:
+            scene.player.move('right')
+        elif dx < -self.aim_tolerance:
+            scene.player.move('left')
+        else:
+            scene.shoot()
+
+
+def step_scene(scene, bot, clock, frame_ms, surface=None):
+    """Plays one frame of `scene` the way `Game.run_frame` does,
+    with a bot instead of a player and a virtual clock instead of real time.
+
+    Args:
+        scene (Scene)
+        bot (Bot): None for scenes without a ship (menu, final scene).
+        clock (VirtualClock)
+        frame_ms (float): simulated duration of the frame.
+        surface (pygame.Surface): if passed, the scene is drawn on it.
+    """
+    for event in pygame.event.get():
+        scene.handle_event(event)
+
+    if bot is not None:
+        bot.act(scene)
+
+    scene.update()
+    if surface is not None:
+        scene.draw(surface)
+    clock.advance(frame_ms)
+
+
+def play_game(resources, clock, difficulty=1, params=None, bot=None, fps=60, max_seconds=300):
+    """Plays a single game with a bot as fast as possible.
+    `VirtualClock` must be installed before the call.
+
+    Args:
+        resources (ResourceManager)
+        clock (VirtualClock)
+        difficulty (int): preset of `MainScene` parameters.
+        params (dict): overrides of preset parameters.
+        bot (Bot)
+        fps (int): simulated frame rate.
+        max_seconds (int): game is stopped after this amount of simulated time.
+
+    Returns:
+        dict: `survival` (seconds), `score`, `frames` and `finished`
+            (False if the game was stopped by `max_seconds`).
+    """
+    bot = bot or Bot()
+    frame_time = 1000 / fps
+    max_frames = int(max_seconds * fps)
+
+    clock.reset()
+    pygame.event.clear()
+    scene = MainScene(resources, difficulty, params)
+    scene.start()
+
+    frame = 0
+    while frame < max_frames and scene.next_scene is scene:
+        step_scene(scene, bot, clock, frame_time)
+        frame += 1
+
+    # Stopping background processes of the scene
+    pygame.time.set_timer(EVENT_SPAWN_ENEMY, 0)
+    pygame.mixer.stop()
+
+    return {
+        'survival': frame / fps,
+        'score': scene.score,
+        'frames': frame,
+        'finished': scene.next_scene is not scene,
+    }
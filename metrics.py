@@ -0,0 +1,166 @@
+"""Runtime metrics in Prometheus text format.
+
+Game code records metrics by incrementing plain attributes of `counters`:
+    metrics.counters.spawns += 1
+That's the whole cost on the hot path, no locks, labels or function calls.
+
+Values which are cheap to read at any moment (e.g. amount of sprites)
+are not recorded at all: they are read by gauge functions
+(see `register_gauge`) only when metrics are exported.
+
+Metrics are exported from a background thread, either
+to a file for node_exporter's textfile collector:
+    python Invaders.py --metrics-file /var/lib/node_exporter/invaders.prom
+or by a local HTTP server:
+    python Invaders.py --metrics-port 9100
+    curl http://127.0.0.1:9100/metrics
+"""
+import os
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+PREFIX = 'invaders_'
+
+
+class Counters:
+    """Every value is only incremented by the game
+    and only read by the exporter thread.
+    """
+    def __init__(self):
+        self.frames = 0
+        self.frame_seconds = 0.0
+        self.spawns = 0
+        self.breaches = 0
+        self.collisions = 0
+        self.text_renders = 0
+        self.sounds = Counter()         # sound name -> times played
+
+
+counters = Counters()
+
+# Attribute of `counters` -> (metric name, type, help)
+COUNTERS = {
+    'spawns': ('spawns_total', 'counter', 'Enemies spawned.'),
+    'breaches': ('breaches_total', 'counter', 'Enemies which reached the bottom of the screen.'),
+    'collisions': ('collisions_total', 'counter',
+                   'Collisions of enemies with ships and projectiles, '
+                   'divide by frames_total to get collisions per tick.'),
+    'text_renders': ('text_renders_total', 'counter', 'Text surfaces rendered by widgets.Text.'),
+}
+
+# name -> (help, function, label), see `register_gauge`
+_gauges = {}
+
+
+def register_gauge(name, help_text, function, label=None):
+    """Adds a metric which is calculated only when metrics are exported.
+
+    Args:
+        name (str): metric name without the prefix.
+        help_text (str)
+        function (Callable): returns a number, or a dict of `label` values -> numbers
+                             if `label` is passed, e.g. `{'enemies': 12, 'projectiles': 3}`.
+                             It's called from the exporter thread.
+        label (str): e.g. `group`.
+    """
+    _gauges[name] = (help_text, function, label)
+
+
+def render():
+    """Returns every metric in Prometheus text exposition format.
+    """
+    lines = []
+
+    def add(name, kind, help_text, samples):
+        """
+        Args:
+            samples (List[Tuple]): (suffix, value) pairs, suffix is labels like `{group="enemies"}`
+                                   or a part of the name like `_sum`.
+        """
+        lines.append(f'# HELP {PREFIX}{name} {help_text}')
+        lines.append(f'# TYPE {PREFIX}{name} {kind}')
+        for suffix, value in samples:
+            lines.append(f'{PREFIX}{name}{suffix} {value}')
+
+    add('frames_total', 'counter', 'Frames rendered.', [('', counters.frames)])
+    add('frame_seconds', 'summary', 'Time spent on a frame, without waiting for the next one.', [
+        ('_sum', round(counters.frame_seconds, 6)),
+        ('_count', counters.frames),
+    ])
+
+    for attribute, (name, kind, help_text) in COUNTERS.items():
+        add(name, kind, help_text, [('', getattr(counters, attribute))])
+
+    sounds = dict(counters.sounds)      # Copy, the game can add a key meanwhile
+    add('sounds_played_total', 'counter', 'Sounds played.',
+        [(f'{{sound="{sound}"}}', count) for sound, count in sorted(sounds.items())])
+
+    for name, (help_text, function, label) in list(_gauges.items()):
+        value = function()
+        if label:
+            samples = [(f'{{{label}="{key}"}}', number) for key, number in value.items()]
+        else:
+            samples = [('', value)]
+        add(name, 'gauge', help_text, samples)
+
+    return '\n'.join(lines) + '\n'
+
+
+class FileExporter:
+    """Rewrites a `.prom` file every `interval` seconds in a daemon thread.
+    The file is replaced atomically, so it's never read half-written.
+    """
+    def __init__(self, path, interval=5):
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(render())
+        os.replace(temp_path, self.path)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.write()                    # Final values
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass                            # Scrapes shouldn't spam the console
+
+
+class HTTPExporter:
+    """Serves metrics on `http://127.0.0.1:<port>/metrics` from a daemon thread.
+    """
+    def __init__(self, port, host='127.0.0.1'):
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
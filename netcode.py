@@ -0,0 +1,853 @@
+"""Two-player co-op over UDP.
+
+The server runs the authoritative simulation (`MainScene` with 2 ships)
+without a window and sends a snapshot of every sprite to every client each tick.
+Clients send only their pressed keys and draw what the server sends.
+
+Snapshots are small:
+    * positions are stored as 11-bit numbers, velocities as 6-bit numbers,
+      all fields are bit-packed (see `BitWriter`)
+    * every snapshot is a delta against the last snapshot acknowledged by the client
+    * enemies and projectiles move (and spin) with constant velocity, so the client
+      predicts their positions itself and the server sends nothing for them,
+      only spawns, removals and ships controlled by players.
+      That's why the size of a snapshot doesn't grow with the amount of enemies.
+
+Start a server and join it:
+    python netcode.py serve --port 5555
+    python Invaders.py --join 127.0.0.1:5555
+
+Measure bandwidth and latency with simulated packet loss:
+    python netcode.py bench --loss 0.1 --latency 0.05 --spawn-ms 100
+
+Check that deltas are decoded exactly after changing the format:
+    python netcode.py check
+"""
+import argparse
+import multiprocessing
+import random
+import socket
+import struct
+import time
+from collections import deque
+
+import pygame
+
+import headless
+from scenes import Scene, MainScene, MenuScene
+from sprites import PLAYER, ENEMY, PROJECTILE, EXPLOSION
+from widgets import LabelPanel
+
+
+DEFAULT_PORT = 5555
+TICK_RATE = 60
+HISTORY_TICKS = 64          # Snapshots older than that can't be used as a base for delta
+CLIENT_TIMEOUT = 5          # Seconds of silence after which a player slot is freed
+
+# Packet types
+INPUT = 1
+SNAPSHOT = 2
+
+# Input bits
+LEFT = 1
+RIGHT = 2
+UP = 4
+DOWN = 8
+SHOOT = 16
+
+# Sizes of bit-packed fields
+ID_BITS = 12
+COUNT_BITS = 12
+KIND_BITS = 2
+POS_BITS = 11
+POS_OFFSET = 128            # Positions from -128 to 1919 px
+VEL_BITS = 6                # Velocities from -32 to 31 px per tick
+DELTA_BITS = 5              # Small corrections from -16 to 15 px
+ANGLE_BITS = 9              # Degrees from 0 to 359
+SPIN_BITS = 6               # Degrees per tick from -32 to 31
+
+# type, ack tick, client time, input bits
+input_header = struct.Struct('=BIdB')
+# type, tick, base tick, echoed client time, lives, score, id of client's ship, energy
+snapshot_header = struct.Struct('=BIIdBHHH')
+
+
+class BitWriter:
+    """Packs unsigned and signed numbers of any bit width into bytes.
+    """
+    def __init__(self):
+        self.value = 0
+        self.bits = 0
+
+    def write(self, value, bits):
+        self.value |= (value & ((1 << bits) - 1)) << self.bits
+        self.bits += bits
+
+    def write_signed(self, value, bits):
+        # Two's complement, the mask in `write` cuts the sign
+        self.write(value, bits)
+
+    def to_bytes(self):
+        return self.value.to_bytes((self.bits + 7) // 8, 'little')
+
+
+class BitReader:
+    """Reads numbers written by `BitWriter`.
+    """
+    def __init__(self, data):
+        self.value = int.from_bytes(data, 'little')
+
+    def read(self, bits):
+        result = self.value & ((1 << bits) - 1)
+        self.value >>= bits
+        return result
+
+    def read_signed(self, bits):
+        result = self.read(bits)
+        if result >= 1 << (bits - 1):
+            result -= 1 << bits
+        return result
+
+
+def fits(value, bits):
+    """Whether a signed `value` can be stored in `bits` bits.
+    """
+    return -(1 << (bits - 1)) <= value < 1 << (bits - 1)
+
+
+def predict(entity, ticks):
+    """Where an entity will be in `ticks` ticks if it keeps its velocity and spin.
+
+    Args:
+        entity (Tuple[int]): (kind, x, y, vx, vy, angle, spin)
+    """
+    kind, x, y, vx, vy, angle, spin = entity
+    return kind, x + vx * ticks, y + vy * ticks, vx, vy, (angle + spin * ticks) % 360, spin
+
+
+def encode_delta(state, base, ticks):
+    """Encodes `state` as a difference from `base`.
+
+    Args:
+        state (dict): entity id -> (kind, x, y, vx, vy, angle, spin), current state.
+                      Position is the top left corner of the unrotated image.
+        base (dict): the state known by the client, empty for a full snapshot.
+        ticks (int): how many ticks passed since `base`.
+
+    Returns:
+        bytes
+    """
+    writer = BitWriter()
+
+    removed = [entity_id for entity_id in base if entity_id not in state]
+    writer.write(len(removed), COUNT_BITS)
+    for entity_id in removed:
+        writer.write(entity_id, ID_BITS)
+
+    # Only entities which are not where the client expects them to be
+    changed = []
+    for entity_id, entity in state.items():
+        old = base.get(entity_id)
+        expected = predict(old, ticks) if old else None
+        if entity != expected:
+            changed.append((entity_id, entity, expected))
+
+    writer.write(len(changed), COUNT_BITS)
+    for entity_id, (kind, x, y, vx, vy, angle, spin), expected in changed:
+        writer.write(entity_id, ID_BITS)
+
+        if expected is None:                # New entity
+            writer.write(1, 1)
+            writer.write(kind, KIND_BITS)
+            writer.write(x + POS_OFFSET, POS_BITS)
+            writer.write(y + POS_OFFSET, POS_BITS)
+            writer.write_signed(vx, VEL_BITS)
+            writer.write_signed(vy, VEL_BITS)
+            # Only spinning enemies spend more than a bit on rotation
+            writer.write(bool(angle or spin), 1)
+            if angle or spin:
+                writer.write(angle, ANGLE_BITS)
+                writer.write_signed(spin, SPIN_BITS)
+            continue
+
+        writer.write(0, 1)
+        dx = x - expected[1]
+        dy = y - expected[2]
+        if fits(dx, DELTA_BITS) and fits(dy, DELTA_BITS):
+            writer.write(1, 1)
+            writer.write_signed(dx, DELTA_BITS)
+            writer.write_signed(dy, DELTA_BITS)
+        else:
+            writer.write(0, 1)
+            writer.write(x + POS_OFFSET, POS_BITS)
+            writer.write(y + POS_OFFSET, POS_BITS)
+
+        if (vx, vy) != expected[3:5]:
+            writer.write(1, 1)
+            writer.write_signed(vx, VEL_BITS)
+            writer.write_signed(vy, VEL_BITS)
+        else:
+            writer.write(0, 1)
+
+        if (angle, spin) != expected[5:]:
+            writer.write(1, 1)
+            writer.write(angle, ANGLE_BITS)
+            writer.write_signed(spin, SPIN_BITS)
+        else:
+            writer.write(0, 1)
+
+    return writer.to_bytes()
+
+
+def decode_delta(data, base, ticks):
+    """Restores a state encoded by `encode_delta`.
+    """
+    reader = BitReader(data)
+    state = {entity_id: predict(entity, ticks) for entity_id, entity in base.items()}
+
+    for _ in range(reader.read(COUNT_BITS)):
+        state.pop(reader.read(ID_BITS), None)
+
+    for _ in range(reader.read(COUNT_BITS)):
+        entity_id = reader.read(ID_BITS)
+
+        if reader.read(1):                  # New entity
+            kind = reader.read(KIND_BITS)
+            x = reader.read(POS_BITS) - POS_OFFSET
+            y = reader.read(POS_BITS) - POS_OFFSET
+            vx = reader.read_signed(VEL_BITS)
+            vy = reader.read_signed(VEL_BITS)
+            angle = spin = 0
+            if reader.read(1):
+                angle = reader.read(ANGLE_BITS)
+                spin = reader.read_signed(SPIN_BITS)
+            state[entity_id] = (kind, x, y, vx, vy, angle, spin)
+            continue
+
+        kind, x, y, vx, vy, angle, spin = state[entity_id]
+        if reader.read(1):
+            x += reader.read_signed(DELTA_BITS)
+            y += reader.read_signed(DELTA_BITS)
+        else:
+            x = reader.read(POS_BITS) - POS_OFFSET
+            y = reader.read(POS_BITS) - POS_OFFSET
+
+        if reader.read(1):
+            vx = reader.read_signed(VEL_BITS)
+            vy = reader.read_signed(VEL_BITS)
+
+        if reader.read(1):
+            angle = reader.read(ANGLE_BITS)
+            spin = reader.read_signed(SPIN_BITS)
+
+        state[entity_id] = (kind, x, y, vx, vy, angle, spin)
+
+    return state
+
+
+class Link:
+    """UDP socket which can simulate a bad network:
+    drops `loss` share of sent packets and delays the rest by `latency` seconds.
+    """
+    def __init__(self, sock, loss=0.0, latency=0.0, jitter=0.0):
+        self.sock = sock
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.delayed = []       # (send time, data, address)
+
+        self.sent_bytes = 0
+        self.sent_packets = 0
+
+    def send(self, data, address):
+        if self.loss and random.random() < self.loss:
+            return
+
+        if self.latency or self.jitter:
+            due = time.perf_counter() + self.latency + random.random() * self.jitter
+            self.delayed.append((due, data, address))
+        else:
+            self.send_now(data, address)
+
+    def send_now(self, data, address):
+        self.sock.sendto(data, address)
+        self.sent_bytes += len(data)
+        self.sent_packets += 1
+
+    def flush(self):
+        """Sends delayed packets which are due.
+        """
+        if not self.delayed:
+            return
+
+        now = time.perf_counter()
+        waiting = []
+        for packet in self.delayed:
+            if packet[0] <= now:
+                self.send_now(packet[1], packet[2])
+            else:
+                waiting.append(packet)
+        self.delayed = waiting
+
+    def receive(self):
+        """Returns every packet which has arrived, never waits.
+
+        Returns:
+            List[Tuple[bytes, Tuple]]: (data, address) pairs.
+        """
+        packets = []
+        while True:
+            try:
+                packets.append(self.sock.recvfrom(2048))
+            except (BlockingIOError, ConnectionResetError):
+                return packets
+
+
+def create_socket(address=None):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if address:
+        sock.bind(address)
+    sock.setblocking(False)
+    return sock
+
+
+class RemotePlayer:
+    """Server side of a connected client.
+    """
+    def __init__(self, slot):
+        self.slot = slot
+        self.ack = 0                # Last snapshot received by client
+        self.input = 0
+        self.echo = 0.0             # Client's time from the last input, to measure latency
+        self.last_seen = time.perf_counter()
+
+
+class Server:
+    """Runs the game for 2 players and sends snapshots to them.
+    """
+    def __init__(self, port=DEFAULT_PORT, difficulty=1, params=None, loss=0.0, latency=0.0, host='127.0.0.1'):
+        self.resources = headless.init_headless()
+        self.link = Link(create_socket((host, port)), loss, latency)
+
+        self.difficulty = difficulty
+        self.params = params
+        self.clients = {}           # address -> RemotePlayer
+        self.tick = 0
+        self.next_id = 1
+        self.history = {}           # tick -> state
+        self.ticks = deque()
+
+        self.new_game()
+
+    def new_game(self):
+        self.scene = MainScene(self.resources, self.difficulty, self.params)
+        self.scene.start()
+        second = self.scene.sprites.create_player()
+
+        width = self.scene.width
+        self.scene.player.rect.centerx = width // 3
+        second.rect.centerx = width * 2 // 3
+        self.players = [self.scene.player, second]
+        for player in self.players:
+            player.last_shot_time = 0
+
+    def run(self, seconds=None):
+        clock = pygame.time.Clock()
+        end = time.perf_counter() + seconds if seconds else None
+
+        while not end or time.perf_counter() < end:
+            clock.tick(TICK_RATE)
+            self.step()
+
+    def step(self):
+        self.receive_inputs()
+
+        for event in pygame.event.get():
+            self.scene.handle_event(event)      # Spawning enemies and breaches
+
+        for client in self.clients.values():
+            self.apply_input(self.players[client.slot], client.input)
+
+        self.scene.handle_collisions()
+        self.scene.sprites.update()
+        if not self.scene.params['player_lives']:
+            self.new_game()
+
+        self.tick += 1
+        state = self.collect_state()
+        self.remember(state)
+        for address, client in self.clients.items():
+            self.send_snapshot(address, client, state)
+
+        self.link.flush()
+
+    def receive_inputs(self):
+        now = time.perf_counter()
+        for data, address in self.link.receive():
+            if len(data) != input_header.size or data[0] != INPUT:
+                continue
+
+            client = self.clients.get(address)
+            if client is None:
+                client = self.connect(address)
+                if client is None:
+                    continue
+
+            _, ack, client_time, bits = input_header.unpack(data)
+            # Packets can come out of order, older ones are ignored
+            if client_time > client.echo:
+                client.ack = max(client.ack, ack)
+                client.input = bits
+                client.echo = client_time
+            client.last_seen = now
+
+        for address, client in list(self.clients.items()):
+            if now - client.last_seen > CLIENT_TIMEOUT:
+                del self.clients[address]
+
+    def connect(self, address):
+        busy = {client.slot for client in self.clients.values()}
+        free = [slot for slot in range(len(self.players)) if slot not in busy]
+        if not free:
+            return None
+
+        self.clients[address] = RemotePlayer(free[0])
+        return self.clients[address]
+
+    def apply_input(self, player, bits):
+        for bit, direction in ((LEFT, 'left'), (RIGHT, 'right'), (UP, 'up'), (DOWN, 'down')):
+            if bits & bit:
+                player.move(direction)
+
+        if bits & SHOOT:
+            self.shoot(player)
+
+    def shoot(self, player):
+        """Same rules as `MainScene.shoot`, but for any ship.
+        """
+        params = self.scene.params
+        current_time = pygame.time.get_ticks()
+
+        cooldown_passed = current_time - player.last_shot_time > params['player_cooldown']
+        if cooldown_passed and player.energy >= params['shoot_cost']:
+            self.scene.sprites.create_projectile(player)
+            player.last_shot_time = current_time
+            player.energy -= params['shoot_cost']
+
+    def collect_state(self):
+        sprites = self.scene.sprites
+        state = {}
+        for kind, group in sprites.groups_by_kind:
+            for sprite in group:
+                entity_id = getattr(sprite, 'net_id', None)
+                if entity_id is None:
+                    entity_id = sprite.net_id = self.next_id
+                    self.next_id = self.next_id % ((1 << ID_BITS) - 1) + 1     # 0 is never used
+
+                vy = angle = spin = 0
+                if kind == ENEMY:
+                    vy = sprite.velocity
+                    angle = round(sprite.angle) % 360
+                    spin = max(-32, min(31, round(sprite.spin)))
+                elif kind == PROJECTILE:
+                    vy = -sprite.velocity
+
+                # Position of the unrotated image, it moves with constant velocity
+                x = sprite.rect.x - sprite.offset[0]
+                y = sprite.rect.y - sprite.offset[1]
+                state[entity_id] = (kind, x, y, 0, vy, angle, spin)
+
+        return state
+
+    def remember(self, state):
+        self.history[self.tick] = state
+        self.ticks.append(self.tick)
+        if len(self.ticks) > HISTORY_TICKS:
+            del self.history[self.ticks.popleft()]
+
+    def send_snapshot(self, address, client, state):
+        # Delta against the last snapshot the client has, or a full one
+        base_tick = client.ack if client.ack in self.history else 0
+        base = self.history.get(base_tick, {})
+        payload = encode_delta(state, base, self.tick - base_tick)
+
+        player = self.players[client.slot]
+        header = snapshot_header.pack(
+            SNAPSHOT, self.tick, base_tick, client.echo,
+            min(self.scene.params['player_lives'], 255),
+            min(self.scene.score, 0xffff),
+            getattr(player, 'net_id', 0),
+            player.energy
+        )
+        self.link.send(header + payload, address)
+
+
+class Client:
+    """Sends pressed keys to the server and keeps recent snapshots
+    to draw sprites smoothly between them.
+    """
+    # Sprites are shown this many ticks in the past,
+    # so there is usually a newer snapshot to interpolate to.
+    INTERPOLATION_DELAY = 3
+
+    def __init__(self, address, loss=0.0, latency=0.0):
+        self.server = address
+        self.link = Link(create_socket(), loss, latency)
+
+        self.history = {}           # tick -> state
+        self.latest = 0
+        self.render_tick = None
+
+        self.lives = 0
+        self.score = 0
+        self.energy = 0
+        self.own_id = 0
+        self.ping = 0.0
+
+        self.received_bytes = 0
+        self.snapshots = 0
+        self.full_snapshots = 0
+
+    def send_input(self, bits):
+        self.link.send(input_header.pack(INPUT, self.latest, time.perf_counter(), bits), self.server)
+        self.link.flush()
+
+    def poll(self):
+        """Receives every arrived snapshot, should be called once per frame.
+
+        Returns:
+            List[Tuple[bytes, dict]]: received packets with decoded states.
+        """
+        received = []
+        for data, _ in self.link.receive():
+            state = self.receive(data)
+            if state is not None:
+                received.append((data, state))
+
+        self.link.flush()
+        self.advance()
+        return received
+
+    def receive(self, data):
+        if len(data) < snapshot_header.size or data[0] != SNAPSHOT:
+            return None
+
+        _, tick, base_tick, echo, lives, score, own_id, energy = snapshot_header.unpack_from(data)
+        if tick in self.history:
+            return None             # Duplicate
+
+        base = self.history.get(base_tick) if base_tick else {}
+        if base is None:
+            return None             # Base was already forgotten, the server will send a newer one
+
+        state = decode_delta(data[snapshot_header.size:], base, tick - base_tick)
+        self.history[tick] = state
+        for old in [old for old in self.history if old <= tick - HISTORY_TICKS]:
+            del self.history[old]
+
+        self.received_bytes += len(data)
+        self.snapshots += 1
+        self.full_snapshots += not base_tick
+
+        if tick > self.latest:
+            self.latest = tick
+            self.lives, self.score, self.own_id, self.energy = lives, score, own_id, energy
+            self.ping = time.perf_counter() - echo
+
+        return state
+
+    def advance(self):
+        """Moves the render time one tick forward, staying close to
+        `INTERPOLATION_DELAY` ticks behind the latest snapshot.
+        """
+        if not self.latest:
+            return
+
+        target = self.latest - self.INTERPOLATION_DELAY
+        if self.render_tick is None or abs(target - self.render_tick) > TICK_RATE / 4:
+            self.render_tick = target
+        else:
+            # Gently speeding up or slowing down instead of jumping
+            self.render_tick += 1 + (target - self.render_tick) * 0.1
+
+    def entities(self):
+        """Returns sprites to draw, interpolated between two snapshots.
+
+        Returns:
+            List[Tuple[int]]: (entity id, kind, x, y, angle), position of the unrotated image.
+        """
+        if self.render_tick is None:
+            return []
+
+        older = [tick for tick in self.history if tick <= self.render_tick]
+        newer = [tick for tick in self.history if tick > self.render_tick]
+        if not older:
+            return self.as_entities(self.history[min(newer)])
+        if not newer:
+            # No newer snapshot yet (lost or late), sprites keep moving by prediction
+            tick = max(older)
+            state = self.history[tick]
+            ticks = self.render_tick - tick
+            return [(entity_id, kind, x + vx * ticks, y + vy * ticks, angle + spin * ticks)
+                    for entity_id, (kind, x, y, vx, vy, angle, spin) in state.items()]
+
+        a_tick, b_tick = max(older), min(newer)
+        a, b = self.history[a_tick], self.history[b_tick]
+        t = (self.render_tick - a_tick) / (b_tick - a_tick)
+
+        entities = []
+        for entity_id, (kind, x, y, _, _, angle, _) in b.items():
+            old = a.get(entity_id)
+            if old:
+                x = old[1] + (x - old[1]) * t
+                y = old[2] + (y - old[2]) * t
+                # The shortest way around the circle
+                angle = old[5] + ((angle - old[5] + 180) % 360 - 180) * t
+            entities.append((entity_id, kind, x, y, angle))
+        return entities
+
+    @staticmethod
+    def as_entities(state):
+        return [(entity_id, kind, x, y, angle) for entity_id, (kind, x, y, _, _, angle, _) in state.items()]
+
+    def close(self):
+        self.link.sock.close()
+
+
+class NetworkScene(Scene):
+    """The game played on a server, see `Server`.
+    Sends pressed keys and draws sprites received from the server.
+    """
+    IMAGES = {
+        PLAYER: 'player',
+        ENEMY: 'enemy',
+        PROJECTILE: 'projectile',
+        EXPLOSION: 'explosion',
+    }
+    ASSETS = {'images': ('bg',) + tuple(IMAGES.values()), 'sounds': ()}
+
+    def __init__(self, resources, address):
+        """
+        Args:
+            resources (ResourceManager)
+            address (Tuple): (host, port) of the server.
+        """
+        super().__init__(resources)
+        self.client = Client(address)
+        self.labels = LabelPanel(3)
+
+    def reset(self, address):
+        super().reset()
+        self.client = Client(address)
+
+    def stop(self):
+        # Not in `handle_event`: the scene is still updated in the frame Escape is pressed
+        self.client.close()
+
+    def handle_event(self, event):
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+            self.next_scene = self.create_scene(MenuScene)
+
+    def update(self):
+        pressed = pygame.key.get_pressed()
+        keys = (
+            (pygame.K_LEFT, LEFT),
+            (pygame.K_RIGHT, RIGHT),
+            (pygame.K_UP, UP),
+            (pygame.K_DOWN, DOWN),
+            (pygame.K_SPACE, SHOOT),
+        )
+        bits = 0
+        for key, bit in keys:
+            if pressed[key]:
+                bits |= bit
+
+        self.client.send_input(bits)
+        self.client.poll()
+
+        status = f'Ping: {self.client.ping * 1000:.0f} ms' if self.client.latest else 'Connecting...'
+        self.labels.update((
+            f'Lives: {self.client.lives}',
+            f'Score: {self.client.score}',
+            status
+        ))
+
+    def draw(self, surface):
+        images = self.resources.images
+        surface.blit(images['bg'].img, (0, 0))
+        for _, kind, x, y, angle in self.client.entities():
+            image = images[self.IMAGES[kind]]
+            if angle:
+                variant = image.get_variant(angle)
+                surface.blit(variant.img, (x + variant.offset[0], y + variant.offset[1]))
+            else:
+                surface.blit(image.img, (x, y))
+        self.labels.draw(surface)
+
+
+def parse_address(text):
+    """`host:port` or `host` -> (host, port)
+    """
+    host, _, port = text.partition(':')
+    return host or '127.0.0.1', int(port or DEFAULT_PORT)
+
+
+def run_server(port=DEFAULT_PORT, difficulty=1, params=None, loss=0.0, latency=0.0, seconds=None):
+    server = Server(port, difficulty, params, loss, latency)
+    print(f'Server is listening on port {port}.')
+    server.run(seconds)
+
+
+def run_benchmark(clients=2, seconds=10, loss=0.0, latency=0.0, spawn_ms=0, port=DEFAULT_PORT):
+    """Starts a local server and bots, prints bandwidth and latency per client
+    and snapshot size depending on the amount of enemies.
+    """
+    # Bots never lose, so the game lasts for the whole benchmark
+    params = {'player_lives': 255}
+    if spawn_ms:
+        params.update(spawn_timer_min=spawn_ms, spawn_timer_max=spawn_ms)
+
+    server = multiprocessing.Process(
+        target=run_server,
+        args=(port, 1, params, loss, latency, seconds + 3),
+        daemon=True
+    )
+    server.start()
+    time.sleep(1)       # Waiting for the server to start
+
+    bots = [Client(('127.0.0.1', port), loss, latency) for _ in range(clients)]
+    sizes = {}          # enemies // 10 -> list of snapshot sizes
+    pings = [[] for _ in bots]
+
+    end = time.perf_counter() + seconds
+    next_tick = time.perf_counter()
+    while time.perf_counter() < end:
+        for i, bot in enumerate(bots):
+            bot.send_input(random.choice((LEFT, RIGHT)) | SHOOT)
+            for data, state in bot.poll():
+                enemies = sum(entity[0] == ENEMY for entity in state.values())
+                sizes.setdefault(enemies // 10, []).append(len(data))
+            if bot.latest:
+                pings[i].append(bot.ping)
+
+        next_tick += 1 / TICK_RATE
+        time.sleep(max(0.0, next_tick - time.perf_counter()))
+
+    server.join()
+
+    print(f'{clients} clients, {seconds} s, loss {loss:.0%}, latency {latency * 1000:.0f} ms')
+    for i, bot in enumerate(bots):
+        ping = sorted(pings[i]) or [0]
+        print(
+            f'client {i}: {bot.snapshots} snapshots ({bot.full_snapshots} full), '
+            f'{bot.received_bytes / seconds / 1024:.1f} KiB/s down, '
+            f'{bot.link.sent_bytes / seconds / 1024:.1f} KiB/s up, '
+            f'ping p50 {ping[len(ping) // 2] * 1000:.1f} ms, p95 {ping[int(len(ping) * 0.95)] * 1000:.1f} ms'
+        )
+        bot.close()
+
+    print('enemies  snapshots  avg bytes')
+    for bucket in sorted(sizes):
+        values = sizes[bucket]
+        print(f'{bucket * 10:>3}-{bucket * 10 + 9:<3}  {len(values):>9}  {sum(values) / len(values):>9.1f}')
+
+
+def check_round_trip(trials=2000, seed=0):
+    """Encodes random states against random bases and checks that
+    `decode_delta` restores every state exactly.
+
+    Entities of a base are removed, left where they are predicted,
+    moved a little (delta), moved far (full position), or get a new
+    velocity and rotation. New entities are added too, so full snapshots
+    (empty base) are covered as well.
+
+    Raises:
+        AssertionError: if a decoded state differs from the encoded one.
+    """
+    rng = random.Random(seed)
+    low, high = -POS_OFFSET, (1 << POS_BITS) - POS_OFFSET - 1
+    max_velocity = (1 << (VEL_BITS - 1)) - 1
+    max_spin = (1 << (SPIN_BITS - 1)) - 1
+
+    def random_entity(kind=None):
+        kind = rng.randrange(4) if kind is None else kind
+        angle = spin = 0
+        if kind == ENEMY and rng.random() < 0.5:
+            angle = rng.randrange(360)
+            spin = rng.randint(-max_spin - 1, max_spin)
+        return (
+            kind, rng.randint(low, high), rng.randint(low, high),
+            rng.randint(-max_velocity - 1, max_velocity), rng.randint(-max_velocity - 1, max_velocity),
+            angle, spin
+        )
+
+    cases = dict.fromkeys(('removed', 'predicted', 'delta', 'full position', 'velocity', 'new'), 0)
+    ids = range(1, 1 << ID_BITS)
+    for _ in range(trials):
+        ticks = rng.randint(1, HISTORY_TICKS)
+        entity_ids = rng.sample(ids, rng.randint(0, 40))
+        split = rng.randint(0, len(entity_ids))
+        base = {entity_id: random_entity() for entity_id in entity_ids[:split]}
+
+        state = {}
+        for entity_id, entity in base.items():
+            expected = predict(entity, ticks)
+            kind, x, y = expected[:3]
+            case = rng.choice(('removed', 'predicted', 'delta', 'full position', 'velocity'))
+            if case == 'removed':
+                cases[case] += 1
+                continue
+            elif case == 'delta':
+                limit = 1 << (DELTA_BITS - 1)
+                x += rng.randint(-limit, limit - 1)
+                y += rng.randint(-limit, limit - 1)
+                state[entity_id] = (kind, x, y) + expected[3:]
+            elif case == 'full position':
+                state[entity_id] = (kind, rng.randint(low, high), rng.randint(low, high)) + expected[3:]
+            elif case == 'velocity':
+                state[entity_id] = (kind, x, y) + random_entity(kind)[3:]
+            else:
+                state[entity_id] = expected
+            cases[case] += 1
+
+        for entity_id in entity_ids[split:]:
+            state[entity_id] = random_entity()
+            cases['new'] += 1
+
+        decoded = decode_delta(encode_delta(state, base, ticks), base, ticks)
+        if decoded != state:
+            raise AssertionError(f'decode_delta restored another state after {ticks} ticks.')
+
+    print(f'Round trip OK: {trials} deltas, entities: {cases}.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Co-op server and network benchmark.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='run a server')
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve.add_argument('--difficulty', type=int, default=1, choices=(0, 1, 2))
+
+    bench = commands.add_parser('bench', help='measure bandwidth and latency with local bots')
+    bench.add_argument('--port', type=int, default=DEFAULT_PORT)
+    bench.add_argument('--clients', type=int, default=2, choices=(1, 2))
+    bench.add_argument('--seconds', type=int, default=10)
+    bench.add_argument('--loss', type=float, default=0.0, help='share of lost packets, e.g. 0.1')
+    bench.add_argument('--latency', type=float, default=0.0, help='one way delay in seconds')
+    bench.add_argument('--spawn-ms', type=int, default=0, help='spawn enemies more often to stress the network')
+
+    check = commands.add_parser('check', help='check that every kind of delta is decoded exactly')
+    check.add_argument('--trials', type=int, default=2000)
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        run_server(args.port, args.difficulty)
+    elif args.command == 'check':
+        check_round_trip(args.trials)
+    else:
+        run_benchmark(args.clients, args.seconds, args.loss, args.latency, args.spawn_ms, args.port)
+
+
+if __name__ == '__main__':
+    main()
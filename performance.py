@@ -0,0 +1,143 @@
+"""Adaptive quality for weak hardware.
+
+`governor` watches how long frames take and, when they don't fit
+into the frame budget, turns off less important work step by step:
+
+    0: full quality
+    1: explosions are not drawn
+    2: HUD is updated a few times per second instead of every frame
+    3: only essential sounds are played (music, warnings)
+    4: amount of live enemies is limited
+    5: enemies spawn less often
+
+Every level includes all previous ones.
+When frames become fast again, quality is restored one level at a time.
+
+Game objects ask the governor what they may do, for example:
+    if performance.governor.draw_explosions:
+        ...
+"""
+from collections import deque
+
+
+LEVEL_NAMES = (
+    'full quality',
+    'explosions hidden',
+    'HUD throttled',
+    'essential sounds only',
+    'enemies capped',
+    'slower spawns',
+)
+
+# Played regardless of the level, the game is hard to understand without them
+ESSENTIAL_SOUNDS = ('ost', 'warning', 'no_energy')
+
+
+class PerformanceGovernor:
+    """Chooses a quality level from a rolling window of frame times.
+    """
+    def __init__(self, fps=60, window=60, high=0.85, low=0.5, recovery=180,
+                 hud_interval=10, max_enemies=20, spawn_factor=2):
+        """
+        Args:
+            fps (int): target frame rate, defines the frame budget.
+            window (int): amount of frames to average.
+                          After every transition a whole new window is collected,
+                          so levels can't change more often than that.
+            high (float): quality goes down if average frame time is above
+                          this share of the budget.
+            low (float): quality goes up if average frame time is below
+                         this share of the budget.
+            recovery (int): quality goes up only if average frame time stays low
+                            for this amount of frames in a row, otherwise it would
+                            jump up and down every `window` frames.
+            hud_interval (int): HUD is updated once per this amount of frames when throttled.
+            max_enemies (int): limit of live enemies when capped.
+            spawn_factor (float): spawn timer is multiplied by it when spawns are slowed.
+        """
+        self.budget = 1000 / fps
+        self.high = high
+        self.low = low
+        self.recovery = recovery
+        self.headroom_frames = 0
+        self.hud_interval_limit = hud_interval
+        self.max_enemies_limit = max_enemies
+        self.spawn_factor_limit = spawn_factor
+
+        self.enabled = False
+        self.level = 0
+        self.frame_times = deque(maxlen=window)
+        self.total = 0.0
+        self.transitions = []       # (from level, to level, average frame time)
+
+        self.apply_level()
+
+    def enable(self, fps=None):
+        """The governor does nothing until enabled,
+        so headless simulations always run in full quality.
+        """
+        if fps:
+            self.budget = 1000 / fps
+        self.enabled = True
+
+    def record(self, frame_ms):
+        """Adds duration of the last frame (without waiting for the next one)
+        and changes the level if needed.
+
+        Args:
+            frame_ms (float)
+        """
+        if not self.enabled:
+            return
+
+        frame_times = self.frame_times
+        if len(frame_times) == frame_times.maxlen:
+            self.total -= frame_times[0]
+        frame_times.append(frame_ms)
+        self.total += frame_ms
+
+        if len(frame_times) < frame_times.maxlen:
+            return
+
+        average = self.total / len(frame_times)
+        if average > self.budget * self.high:
+            self.headroom_frames = 0
+            if self.level < len(LEVEL_NAMES) - 1:
+                self.set_level(self.level + 1, average)
+        elif average < self.budget * self.low:
+            self.headroom_frames += 1
+            if self.headroom_frames >= self.recovery and self.level > 0:
+                self.set_level(self.level - 1, average)
+        else:
+            self.headroom_frames = 0
+
+    def set_level(self, level, average=0.0):
+        print(
+            f'Performance: level {self.level} -> {level} ({LEVEL_NAMES[level]}), '
+            f'average frame {average:.1f} ms, budget {self.budget:.1f} ms.'
+        )
+        self.transitions.append((self.level, level, average))
+        self.level = level
+        self.apply_level()
+
+        # Effect of the new level is measured from scratch
+        self.frame_times.clear()
+        self.total = 0.0
+        self.headroom_frames = 0
+
+    def apply_level(self):
+        """Sets attributes which are checked by game objects.
+        They are plain attributes, so checking them costs nothing in the main loop.
+        """
+        level = self.level
+        self.draw_explosions = level < 1
+        self.hud_interval = self.hud_interval_limit if level >= 2 else 1
+        self.all_sounds = level < 3
+        self.max_enemies = self.max_enemies_limit if level >= 4 else None
+        self.spawn_factor = self.spawn_factor_limit if level >= 5 else 1
+
+    def allows_sound(self, name):
+        return self.all_sounds or name in ESSENTIAL_SOUNDS
+
+
+governor = PerformanceGovernor()
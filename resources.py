@@ -1,5 +1,9 @@
 import pygame
 import os
+from collections import Counter, OrderedDict
+
+import metrics
+from startup import NullTrace
 
 
 class Image:
@@ -13,6 +17,18 @@ class Image:
         self.img = self.convert()
         self.img = self.scale(width, height)
         self.mask = self.get_mask()
+        self.collision = CollisionData(self.mask)
+
+    @classmethod
+    def from_surface(cls, surface):
+        """Creates an image from a surface which is already converted and scaled,
+        e.g. a region of a texture atlas (see `atlas.py`).
+        """
+        image = cls.__new__(cls)
+        image.img = surface
+        image.mask = image.get_mask()
+        image.collision = CollisionData(image.mask)
+        return image
 
     def load(self, filename):
         """Loads image from almost any file.
@@ -93,48 +109,510 @@ class Image:
         """
         return pygame.mask.from_surface(self.img)
 
+    def get_size_bytes(self):
+        """Memory taken by pixels and the mask.
+        Pixels of a subsurface (e.g. an atlas region) belong to its parent and aren't counted.
+        """
+        width, height = self.img.get_size()
+        pixels = 0 if self.img.get_parent() else self.img.get_pitch() * height
+        return pixels + width * height // 8
+
+    def get_variant(self, angle, scale=1):
+        """Returns a copy of the image rotated by `angle` degrees (counterclockwise)
+        and scaled by `scale`, with its own mask.
+
+        Angle is rounded to one of `ANGLE_STEPS` steps and scale to `SCALE_STEP`,
+        so there is a limited amount of variants. Each of them is created
+        on the first request and kept in `variant_cache`.
+
+        Args:
+            angle (float)
+            scale (float)
+
+        Returns:
+            ImageVariant
+        """
+        step = round(angle * ANGLE_STEPS / 360) % ANGLE_STEPS
+        zoom = max(1, round(scale / SCALE_STEP))
+        key = (self, step, zoom)
+
+        variant = variant_cache.get(key)
+        if variant is None:
+            variant = ImageVariant(self, step * 360 / ANGLE_STEPS, zoom * SCALE_STEP)
+            variant_cache.put(key, variant)
+
+        return variant
+
+    def prepare_variants(self, scale=1):
+        """Creates every rotation of the image in advance,
+        e.g. while a scene is loading.
+        """
+        for step in range(ANGLE_STEPS):
+            self.get_variant(step * 360 / ANGLE_STEPS, scale)
+
+
+# Precision of `Image.get_variant`
+ANGLE_STEPS = 64
+SCALE_STEP = 0.05
+
+
+class ImageVariant:
+    """Rotated and scaled copy of an `Image`.
+
+    Rotated surface is larger than the original one,
+    `offset` is the position of its top left corner relative
+    to the original's one, so both have the same center.
+    """
+    def __init__(self, image, angle, scale):
+        """
+        Args:
+            image (Image)
+            angle (float): degrees, counterclockwise.
+            scale (float)
+        """
+        self.is_original = angle == 0 and scale == 1
+        if self.is_original:
+            # Nothing to create, surface and mask are shared with the image
+            self.img = image.img
+            self.mask = image.mask
+            self.collision = image.collision
+        else:
+            self.img = pygame.transform.rotozoom(image.img, angle, scale).convert_alpha()
+            self.mask = pygame.mask.from_surface(self.img)
+            self.collision = CollisionData(self.mask)
+
+        width, height = image.img.get_size()
+        self.offset = ((width - self.img.get_width()) // 2, (height - self.img.get_height()) // 2)
+
+    def get_size_bytes(self):
+        """Memory taken by pixels and masks, 0 for the original image.
+        """
+        if self.is_original:
+            return 0
+
+        width, height = self.img.get_size()
+        return self.img.get_pitch() * height + width * height // 8
+
+
+class VariantCache:
+    """Keeps recently used image variants.
+    When they take more than `max_bytes`, the least recently used ones are removed.
+    """
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.variants = OrderedDict()       # key -> (variant, size in bytes)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        item = self.variants.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        self.variants.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def put(self, key, variant):
+        size = variant.get_size_bytes()
+        self.variants[key] = (variant, size)
+        self.bytes += size
+
+        # The newest variant is kept even if it's larger than the limit alone
+        while self.bytes > self.max_bytes and len(self.variants) > 1:
+            _, (_, old_size) = self.variants.popitem(last=False)
+            self.bytes -= old_size
+            self.evictions += 1
+
+    def discard(self, image):
+        """Removes every variant of `image`, e.g. when the image itself is unloaded.
+        """
+        for key in [key for key in self.variants if key[0] is image]:
+            _, size = self.variants.pop(key)
+            self.bytes -= size
+
+    def clear(self):
+        self.variants.clear()
+        self.bytes = 0
+
+
+variant_cache = VariantCache()
+
+
+class CollisionData:
+    """Precomputed data for fast pixel-perfect collisions (see `sprites.collide_hierarchy`).
+
+    Collision check goes from the cheapest level to the most precise one
+    and stops as soon as the answer is known:
+        1. `bounds`:    tight rect around opaque pixels
+        2. `coarse`:    mask where every bit is a `BLOCK x BLOCK` block of pixels,
+                        set if at least one pixel of the block is opaque
+        3. `mask`:      full pixel mask
+    """
+    BLOCK = 8
+
+    def __init__(self, mask):
+        self.mask = mask
+        self.bounds = self.get_bounds()
+        self.coarse = self.get_coarse_mask()
+        self.coarse_dilated = self.get_dilated_mask()
+
+    def get_bounds(self):
+        """Returns the smallest rect containing every opaque pixel,
+        position is relative to the image's top left corner.
+        """
+        rects = self.mask.get_bounding_rects()
+        if not rects:
+            return pygame.Rect(0, 0, 0, 0)      # Fully transparent image never collides
+
+        return rects[0].unionall(rects[1:])
+
+    def get_coarse_mask(self):
+        width, height = self.mask.get_size()
+        block = pygame.mask.Mask((self.BLOCK, self.BLOCK), fill=True)
+        coarse = pygame.mask.Mask((-(-width // self.BLOCK), -(-height // self.BLOCK)))
+
+        for y in range(coarse.get_size()[1]):
+            for x in range(coarse.get_size()[0]):
+                if self.mask.overlap(block, (x * self.BLOCK, y * self.BLOCK)):
+                    coarse.set_at((x, y))
+
+        return coarse
+
+    def get_dilated_mask(self):
+        """Coarse mask expanded by 1 block to the right and to the bottom.
+
+        When two images are shifted by an offset which is not a multiple of `BLOCK`,
+        their blocks don't line up: a pixel of block `n` can touch pixels
+        of blocks `n + offset // BLOCK` and `n + offset // BLOCK + 1` of another image.
+        Checking one coarse mask against the dilated one never misses a collision.
+        """
+        width, height = self.coarse.get_size()
+        dilated = pygame.mask.Mask((width + 1, height + 1))
+        for offset in ((0, 0), (1, 0), (0, 1), (1, 1)):
+            dilated.draw(self.coarse, offset)
+
+        return dilated
+
+
+# Every image used in the game: name -> (file, width, height).
+# Sizes are fractions of the screen size, 0 means `keep aspect ratio`.
+IMAGE_FILES = {
+    'bg': ('BG.jpg', 1, 1),             # Background is stretched to the whole screen
+    'player': ('Ship1.png', 1 / 16, 0),
+    'ship2': ('Ship2.png', 1 / 16, 0),
+    'ship3': ('Ship3.png', 1 / 16, 0),
+    'ship4': ('Ship4.png', 1 / 16, 0),
+    'enemy': ('UFO.png', 1 / 16, 0),
+    'projectile': ('Laser.png', 1 / 70, 0),
+    'explosion': ('Explosion.png', 1 / 8, 0),
+}
+
+SOUND_NAMES = ('ost', 'shot', 'explosion', 'warning', 'beep', 'no_energy')
+
+# Every sprite image of the atlas is a part of one surface,
+# so they are loaded and evicted together as one asset
+ATLAS_KEY = ('atlas', 'sprites')
+
+DEFAULT_BUDGET = 32 * 1024 * 1024
+
+
+def get_sound_bytes(sound):
+    """Memory taken by decoded samples of a sound.
+    """
+    frequency, size, channels = pygame.mixer.get_init()
+    return round(sound.get_length() * frequency) * channels * abs(size) // 8
+
+
+class LazyDict(dict):
+    """Dictionary which creates missing values on the first access
+    by calling `loader(key)`.
+    """
+    def __init__(self, loader):
+        super().__init__()
+        self.loader = loader
+
+    def __missing__(self, key):
+        self[key] = value = self.loader(key)
+        return value
+
 
 class ResourceManager:
     """Loads images and sounds
     which are needed for every scene in the game.  
-    Stores all resources in dictionaries `sounds` and `images`.
-    """
-    def __init__(self):
-        self.sounds = self.load_sounds()
-        self.images = self.load_images()
+    Stores all resources in dictionaries `sounds` and `images`,
+    a missing resource is loaded on the first access.
 
-    def load_sounds(self):
-        """Loads sounds from files using `pygame.Sound` class.
+    In `lazy` mode nothing is loaded in the constructor:
+    every resource is loaded on the first access,
+    or in background by calling `load_pending()` once per frame.
+
+    Sprite images are taken from a texture atlas (see `atlas.py`):
+    the first of them loads all of them at once.
+
+    Scenes declare assets they use (`Scene.ASSETS`), `SceneManager`
+    acquires them while a scene is shown or is predicted to be shown next,
+    and releases them afterwards.
+    When resident assets take more than `budget` bytes, assets which
+    no shown scene uses are evicted, the least recently used first.
+    An evicted asset is loaded again when it's needed.
+    """
+    def __init__(self, lazy=False, trace=None, use_atlas=True, budget=DEFAULT_BUDGET):
+        """
+        Args:
+            lazy (bool): load resources on demand instead of loading all of them at once.
+            trace (StartupTrace): if passed, loading time of every resource is recorded.
+            use_atlas (bool): load sprite images from the atlas instead of separate files.
+            budget (int): bytes which resident assets may take, None means no limit.
+                          Assets used by the shown scene are kept even above the budget.
 
         Raises:
-            pygame.error: if file not found, just prints a message.
+            pygame.error: if pygame.mixer is not initialized.
         """
+        self.trace = trace or NullTrace()
+        self.use_atlas = use_atlas
+        self.atlas = None
+        self.budget = budget
+
+        self.refs = Counter()               # asset key -> amount of shown scenes which use it
+        self.released = {}                  # unused asset key -> number of the `release` call
+        self.releases = 0
+        self.evictions = 0
+
         if not pygame.mixer.get_init():
             raise pygame.error('pygame.mixer is not initialized.')
 
-        sounds = {}
-        sound_names = ['ost', 'shot', 'explosion', 'warning', 'beep', 'no_energy']
+        self.sounds = LazyDict(self.load_sound)
+        self.images = LazyDict(self.load_image)
+        if not lazy:
+            self.sounds.update(self.load_sounds())
+            self.images.update(self.load_images())
+
+    def load_sounds(self):
+        """Loads sounds from files using `pygame.Sound` class.
+        """
+        return {sound: self.load_sound(sound) for sound in SOUND_NAMES}
 
-        for sound in sound_names:
-            path = os.path.join('sounds', f'{sound}.mp3')
+    def load_sound(self, sound):
+        """Loads a single sound by name.
+        If file not found, just prints a message.
+        """
+        path = os.path.join('sounds', f'{sound}.mp3')
+        with self.trace.step(f'sound {sound}'):
             try:
-                sounds[sound] = pygame.mixer.Sound(path)
+                return pygame.mixer.Sound(path)
             except FileNotFoundError:
+                # Like with images, a missing file is replaced
+                # with a silent sound, so scenes can play it as usual.
                 print(f'Ошибка при загрузке аудио: {sound}.mp3')
+                return pygame.mixer.Sound(buffer=bytes(4))
 
-        return sounds
+    def play_sound(self, sound, loops=0):
+        """
+        Args:
+            sound (str): name from `SOUND_NAMES`.
+            loops (int): -1 means `loop indefinitely`.
+        """
+        self.sounds[sound].play(loops)
+        metrics.counters.sounds[sound] += 1
 
     def load_images(self):
         """Loads images from files
         and stores them into a dictionary.
         """
+        return {name: self.load_image(name) for name in IMAGE_FILES}
+
+    def load_image(self, name):
+        """Loads a single image by name,
+        size is calculated from `IMAGE_FILES` and the screen size.
+        """
+        if self.use_atlas:
+            atlas = self.get_atlas()
+            if name in atlas.images:
+                return atlas.images[name]
+
         screen_width, screen_height = pygame.display.get_window_size()
-        images = {}
-        # Background should be stretched to the whole screen
-        images['bg'] = Image('BG.jpg', screen_width, screen_height)
-        images['player'] = Image('Ship1.png', screen_width / 16)
-        images['enemy'] = Image('UFO.png', screen_width / 16)
-        images['projectile'] = Image('Laser.png', screen_width / 70)
-        images['explosion'] = Image('Explosion.png', screen_width / 8)
-
-        return images
+        filename, width, height = IMAGE_FILES[name]
+
+        with self.trace.step(f'image {name}'):
+            return Image(filename, screen_width * width, screen_height * height)
+
+    def get_atlas(self):
+        if self.atlas is None:
+            # Imported here, because `atlas` imports this module
+            from atlas import TextureAtlas
+
+            with self.trace.step('atlas'):
+                self.atlas = TextureAtlas.load()
+
+        return self.atlas
+
+    def load_pending(self):
+        """Loads one acquired resource which hasn't been loaded yet:
+        a resource of the shown scene or of the scene predicted to be next
+        (see `SceneManager.pin`). It's called once per frame to load
+        them in background, without a long pause.
+
+        Resources of other scenes are loaded when they are accessed.
+
+        Returns:
+            bool: False if every used resource is already loaded.
+        """
+        for name in IMAGE_FILES:
+            if name not in self.images and self.refs[self.get_asset_key('images', name)]:
+                self.images[name] = self.load_image(name)
+                return True
+
+        for sound in SOUND_NAMES:
+            if sound not in self.sounds and self.refs[('sounds', sound)]:
+                self.sounds[sound] = self.load_sound(sound)
+                return True
+
+        return False
+
+    def get_asset_key(self, kind, name):
+        """
+        Args:
+            kind (str): 'images' or 'sounds'.
+            name (str)
+
+        Returns:
+            Tuple[str]: (type, name), every image of the atlas has `ATLAS_KEY`.
+        """
+        if kind == 'images' and self.use_atlas:
+            # Imported here, because `atlas` imports this module
+            from atlas import ATLAS_IMAGES
+
+            if name in ATLAS_IMAGES:
+                return ATLAS_KEY
+
+        return kind, name
+
+    def get_asset_keys(self, assets):
+        return {
+            self.get_asset_key(kind, name)
+            for kind, names in assets.items()
+            for name in names
+        }
+
+    def acquire(self, assets):
+        """Marks assets as used by a scene which is shown, they aren't evicted until released.
+        They are loaded as usual: on the first access or by `load_pending`.
+
+        Args:
+            assets (dict): 'images' and 'sounds' -> names, see `Scene.ASSETS`.
+        """
+        for key in self.get_asset_keys(assets):
+            self.refs[key] += 1
+            self.released.pop(key, None)
+
+    def release(self, assets):
+        """Marks assets as no longer used by a scene
+        and evicts unused assets if resident ones don't fit into the budget.
+        """
+        self.releases += 1
+        for key in self.get_asset_keys(assets):
+            self.refs[key] -= 1
+            if self.refs[key] <= 0:
+                del self.refs[key]
+                self.released[key] = self.releases
+
+        self.enforce_budget()
+
+    def get_resident(self):
+        """Returns:
+            dict: asset key -> bytes, for every loaded asset.
+        """
+        resident = {}
+        # Copies, the exporter thread of `metrics` calls it while the game loads resources
+        for name, image in list(self.images.items()):
+            key = self.get_asset_key('images', name)
+            if key != ATLAS_KEY:
+                resident[key] = image.get_size_bytes()
+
+        atlas = self.atlas
+        if atlas is not None:
+            resident[ATLAS_KEY] = atlas.get_size_bytes() + sum(
+                image.get_size_bytes() for image in atlas.images.values()
+            )
+
+        for name, sound in list(self.sounds.items()):
+            resident[('sounds', name)] = get_sound_bytes(sound)
+
+        return resident
+
+    def get_resident_bytes(self):
+        """Returns:
+            dict: asset type ('images', 'atlas' or 'sounds') -> bytes of loaded assets.
+        """
+        totals = dict.fromkeys(('images', 'atlas', 'sounds'), 0)
+        for (kind, _), size in self.get_resident().items():
+            totals[kind] += size
+
+        return totals
+
+    def enforce_budget(self):
+        """Evicts unused assets until resident ones fit into the budget.
+        Assets which no scene has declared go first, then released ones in LRU order.
+        Assets released at the same time go from the largest one,
+        so as few assets as possible are evicted.
+        Sounds which are still playing are kept, evicting them would stop them.
+        """
+        if self.budget is None:
+            return
+
+        resident = self.get_resident()
+        total = sum(resident.values())
+        if total <= self.budget:
+            return
+
+        unused = [key for key in resident if not self.refs[key]]
+        unused.sort(key=lambda key: (self.released.get(key, 0), -resident[key]))
+        for key in unused:
+            if total <= self.budget:
+                break
+            kind, name = key
+            if kind == 'sounds' and self.sounds[name].get_num_channels():
+                continue
+            self.evict(key)
+            total -= resident[key]
+
+    def evict(self, key):
+        """Unloads an asset. Objects which still reference it (e.g. live sprites)
+        keep it in memory until they are deleted.
+        """
+        kind, name = key
+        if key == ATLAS_KEY:
+            names = list(self.atlas.images)
+            self.atlas = None
+        elif kind == 'sounds':
+            names = ()
+            del self.sounds[name]
+        else:
+            names = (name,)
+
+        for image_name in names:
+            image = self.images.pop(image_name, None)
+            if image is not None:
+                variant_cache.discard(image)
+
+        self.released.pop(key, None)
+        self.evictions += 1
+
+    def report(self, file=None):
+        """Prints memory taken by resident assets of every type.
+        """
+        resident = self.get_resident()
+        budget = 'no limit' if self.budget is None else f'{self.budget / 1024 / 1024:.1f} MiB'
+        print(f'Resident assets: {sum(resident.values()) / 1024 / 1024:.1f} MiB (budget {budget}), '
+              f'{self.evictions} evictions', file=file)
+
+        for kind, size in self.get_resident_bytes().items():
+            names = sorted(name for (key_kind, name) in resident if key_kind == kind)
+            used = sum(1 for name in names if self.refs[(kind, name)])
+            print(f'    {kind:>6} {size / 1024:9.1f} KiB  {len(names)} loaded, {used} in use  '
+                  f'{", ".join(names)}', file=file)
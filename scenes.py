@@ -1,13 +1,33 @@
+import time
+
 import pygame
 
+import tasks
 from constants import EVENT_SPAWN_ENEMY, EVENT_ENEMY_BREACH
+from performance import governor
+from snapshots import RewindBuffer
 from sprites import SpriteManager
 from widgets import Text, Menu, LabelPanel, EnergyBar
 
 
 class Scene:
     """A base class for every scene in the game.  
+
+    Life of a scene:
+        __init__ / reset:   prepares everything the scene needs,
+                            without side effects, so it can be done in advance
+                            (see `SceneManager.prewarm`)
+        start:              called when the scene is shown: music, timers etc
+        stop:               called when the scene is left, after its last frame
+
+    `ASSETS` lists images and sounds the scene uses while it's shown,
+    they are kept in memory until the scene is left (see `ResourceManager.acquire`).
     """
+    ASSETS = {'images': (), 'sounds': ()}
+
+    # Set by `SceneManager` for scenes which it can reuse
+    manager = None
+
     def __init__(self, resources):
         """Creates a scene.
 
@@ -18,6 +38,39 @@ class Scene:
         self.resources = resources
         self.next_scene = self
 
+    def reset(self):
+        """Prepares a used scene to be shown again.
+        Subclasses take the same arguments as their `__init__` (except `resources`).
+        """
+        self.next_scene = self
+
+    def start(self):
+        """Will be overrided in subclasses which play music or use timers.
+        """
+        pass
+
+    def stop(self):
+        """Will be overrided in subclasses which hold connections or files.
+        """
+        pass
+
+    def get_likely_next(self):
+        """Scene which will probably be shown after this one.
+
+        Returns:
+            tuple: scene class and its arguments, or None if it's unknown.
+        """
+        return None
+
+    def create_scene(self, scene_class, *args):
+        """Returns a scene to switch to.
+        A managed scene gets an idle instance from `SceneManager` instead of creating a new one.
+        """
+        if self.manager:
+            return self.manager.get(scene_class, *args)
+
+        return scene_class(self.resources, *args)
+
     def handle_event(self, event):
         """Will be overrided in subclasses.
         """
@@ -33,15 +86,34 @@ class Scene:
         """
         raise NotImplementedError('Scene.draw should be implemented in subclasses.')
 
+    def schedule(self, coroutine):
+        """Runs `coroutine` in background, without waiting for it.
+        Use it for I/O like uploading stats or writing files (see `tasks.py`).
+
+        Args:
+            coroutine (Coroutine)
+        """
+        return tasks.schedule(coroutine)
+
 
 class MenuScene(Scene):
+    ASSETS = {'images': ('bg',), 'sounds': ('beep',)}
+
     def __init__(self, resources):
         super().__init__(resources)
         self.index = 1          # 3 menu items: 0, 1, 2
 
+        self.menu = Menu(self.index)
+
+    def reset(self):
+        super().reset()
+        self.index = self.menu.select(1)
+
+    def start(self):
         pygame.mixer.stop()     # Stop music playback
 
-        self.menu = Menu(self.index)
+    def get_likely_next(self):
+        return MainScene, self.index
 
     def handle_event(self, event):
         if event.type == pygame.KEYDOWN:
@@ -57,41 +129,75 @@ class MenuScene(Scene):
     def handle_keypress(self, key):
         # If one of the valid keys is pressed, then play the `beep` sound.
         if key in (pygame.K_LEFT, pygame.K_RIGHT, pygame.K_SPACE, pygame.K_RETURN):
-            self.resources.sounds['beep'].play()
+            self.resources.play_sound('beep')
 
         if key == pygame.K_LEFT:
             self.index = self.menu.switch(-1)   # Move to 1 step left
         elif key == pygame.K_RIGHT:
             self.index = self.menu.switch(1)    # Move to 1 step right
         elif key in (pygame.K_SPACE, pygame.K_RETURN):
-            self.next_scene = MainScene(self.resources, self.index)     # `index` is difficulty
+            self.next_scene = self.create_scene(MainScene, self.index)     # `index` is difficulty
 
 
 class MainScene(Scene):
-    def __init__(self, resources, difficulty):
+    ASSETS = {
+        'images': ('bg', 'player', 'enemy', 'projectile', 'explosion'),
+        'sounds': ('ost', 'shot', 'explosion', 'warning'),
+    }
+
+    def __init__(self, resources, difficulty, params=None):
+        """
+        Args:
+            resources (ResourceManager)
+            difficulty (int): 0, 1 or 2, selects a preset of game parameters.
+            params (dict): overrides some values of the preset,
+                for example `{'enemy_velocity': 3}`.
+        """
         super().__init__(resources)
         self.clock = pygame.time.Clock()        # Uses to measure FPS
 
-        # Setting up basic game parameters.
-        self.setup_params(difficulty)
-        self.score = 0
-        self.last_shot_time = 0
+        # Sprite groups, buffers and widgets are reused by every game started with `reset`
+        self.sprites = SpriteManager({}, self.resources)
 
-        # Creating sprites
-        self.sprites = SpriteManager(self.params, self.resources)
-        self.player = self.sprites.create_player()
+        # Last few seconds of the game, player can rewind them by holding Backspace
+        self.rewind = RewindBuffer()
 
         # Creating widgets
         self.labels = LabelPanel(3)
         self.energy_bar = EnergyBar(
             size=(100, 20), 
-            max_energy=self.player.max_energy
+            max_energy=1            # Real value is set by `reset`
         )
 
+        self.reset(difficulty, params)
+
+    def reset(self, difficulty, params=None):
+        """Prepares a new game.
+        """
+        super().reset()
+
+        # Setting up basic game parameters.
+        self.setup_params(difficulty)
+        if params:
+            self.params.update(params)
+        self.score = 0
+        self.last_shot_time = 0
+        self.frame = 0
+
+        # Creating sprites
+        self.sprites.reset(self.params)
+        self.player = self.sprites.create_player()
+        self.rewind.clear()
+        self.energy_bar.max_energy = self.player.max_energy
+
+    def start(self):
         # Starting background processes
-        self.resources.sounds['ost'].play(-1)   # -1 means `loop indefinitely`
+        self.resources.play_sound('ost', -1)   # -1 means `loop indefinitely`
         self.sprites.set_enemy_spawn_timer()
 
+    def get_likely_next(self):
+        return FinalScene, self.sprites
+
     def handle_event(self, event):
         # EVENT_SPAWN_ENEMY is emitted by timer approximately every 1.5 seconds (depends on difficulty)
         if event.type == EVENT_SPAWN_ENEMY:
@@ -102,27 +208,42 @@ class MainScene(Scene):
             self.handle_enemy_breach()
         elif event.type == pygame.KEYDOWN:
             if event.key == pygame.K_ESCAPE:
-                self.next_scene = MenuScene(self.resources)
+                self.next_scene = self.create_scene(MenuScene)
 
     def update(self):
         if not self.params['player_lives']:
             self.kill_player()
-            self.next_scene = FinalScene(self.resources, self.sprites)
+            self.next_scene = self.create_scene(FinalScene, self.sprites)
             return
 
         self.clock.tick()           # To measure FPS
 
+        # While Backspace is held the game goes backwards instead of forward
+        if pygame.key.get_pressed()[pygame.K_BACKSPACE] and self.rewind.step_back(self):
+            self.update_widgets()
+            return
+
         # Handles `long` keypresses, which can't be conveniently handled via events 
         # due to event's `only once happened` nature.
         self.handle_pressed_keys()
         self.handle_collisions()
 
         self.sprites.update()
+        self.rewind.push(self)
+        self.update_widgets()
+
+    def update_widgets(self):
+        # Under load HUD is updated only once per a few frames (see `performance.py`)
+        throttled = self.frame % governor.hud_interval
+        self.frame += 1
+        if throttled:
+            return
+
         self.energy_bar.update(self.player.energy)
         self.labels.update((
             f'Lives: {self.params["player_lives"]}',
             f'Score: {self.score}',
-            f'FPS: {int(self.clock.get_fps())}'
+            f'FPS: {self.clock.get_fps():.0f}'
         ))
 
     def draw(self, surface):
@@ -188,7 +309,7 @@ class MainScene(Scene):
         self.damage_player(1)
 
         if self.params['player_lives']:
-            self.resources.sounds['warning'].play()
+            self.resources.play_sound('warning')
 
     # This section is for secondary service functions
     def setup_params(self, difficulty):
@@ -258,6 +379,12 @@ class FinalScene(Scene):
     """`You lose` text and fast flying enemies.
     Needs sprites from previous scene.
     """
+    ASSETS = {
+        'images': ('bg', 'player', 'enemy', 'projectile', 'explosion'),
+        # Music of the game keeps playing until the menu is shown
+        'sounds': ('ost', 'explosion'),
+    }
+
     def __init__(self, resources, sprites):
         """
         Args:
@@ -267,17 +394,27 @@ class FinalScene(Scene):
         super().__init__(resources)
 
         self.sprites = sprites
+        self.create_lose_text()      
+
+    def reset(self, sprites):
+        super().reset()
+        self.sprites = sprites
+
+    def start(self):
         self.change_enemies_velocity(10)
         self.sprites.set_enemy_spawn_timer(200)
 
-        self.create_lose_text()      
+    def get_likely_next(self):
+        return MenuScene,
 
     def handle_event(self, event):
         if event.type == EVENT_SPAWN_ENEMY:
             self.sprites.create_enemy()
+            # Re-set every time, so the timer follows changes of quality level
+            self.sprites.set_enemy_spawn_timer(200)
         elif event.type == pygame.KEYDOWN:
             if event.key in (pygame.K_SPACE, pygame.K_RETURN):
-                self.next_scene = MenuScene(self.resources)
+                self.next_scene = self.create_scene(MenuScene)
 
     def update(self):
         self.sprites.update()
@@ -297,3 +434,143 @@ class FinalScene(Scene):
         font = pygame.font.SysFont('calibri', 72)
         self.text = Text('You lose!', font, pygame.Color('red'))
         self.text.rect.center = (self.width / 2, self.height / 2)
+
+
+class SceneManager:
+    """Keeps one instance of every scene class and reuses it
+    instead of creating a new scene on every transition.
+
+    Creating a scene (fonts, text surfaces, sprite groups) can take
+    longer than a frame. `prewarm` does it in advance, when a frame
+    has time left, for the scene which will most likely be shown next.
+
+    The manager also tells `resources` which assets the shown scene uses,
+    so assets of other scenes can be evicted when memory is short.
+
+    Example:
+        scenes = SceneManager(resources)
+        scene = scenes.get(MenuScene)
+        scenes.show(scene)
+        ...
+        if scene.next_scene is not scene:
+            scenes.switch(scene, scene.next_scene, frame_seconds)
+    """
+    def __init__(self, resources, verbose=False):
+        """
+        Args:
+            resources (ResourceManager)
+            verbose (bool): print duration of every transition.
+        """
+        self.resources = resources
+        self.verbose = verbose
+        # scene class -> (instance which isn't shown, arguments it's prepared with or None)
+        self.idle = {}
+        self.transitions = []       # (from class name, to class name, ms)
+        self.pinned = None          # scene class which assets are acquired by `pin`
+
+    def get(self, scene_class, *args):
+        """Returns a scene ready to be shown.
+        Reuses an idle instance, `reset` is skipped if it was already prepared with the same arguments.
+        """
+        scene, prepared_args = self.idle.pop(scene_class, (None, None))
+        if scene is None:
+            scene = scene_class(self.resources, *args)
+            scene.manager = self
+        elif prepared_args != args:
+            scene.reset(*args)
+
+        return scene
+
+    def prewarm(self, scene):
+        """Prepares the scene which will most likely be shown after `scene`.
+        Should be called when a frame has time left, does nothing if it's already prepared.
+        Assets of that scene are pinned, so they are loaded in background as well.
+
+        Returns:
+            bool: True if something was done.
+        """
+        likely = scene.get_likely_next()
+        self.pin(likely[0] if likely else None)
+        if likely is None:
+            return False
+
+        scene_class, args = likely[0], likely[1:]
+        idle, prepared_args = self.idle.get(scene_class, (None, None))
+        if prepared_args == args:
+            return False
+
+        if idle is None:
+            idle = scene_class(self.resources, *args)
+            idle.manager = self
+        else:
+            idle.reset(*args)
+
+        self.idle[scene_class] = (idle, args)
+        return True
+
+    def pin(self, scene_class):
+        """Acquires assets of the scene which will most likely be shown next,
+        so `ResourceManager.load_pending` loads them before the transition
+        and they are never evicted. Assets of the previous prediction are released.
+
+        Args:
+            scene_class (type): None if the next scene is unknown.
+        """
+        if scene_class is self.pinned:
+            return
+
+        if scene_class is not None:
+            self.resources.acquire(scene_class.ASSETS)
+        if self.pinned is not None:
+            self.resources.release(self.pinned.ASSETS)
+        self.pinned = scene_class
+
+    def show(self, scene):
+        """Acquires assets of the scene and starts it.
+        Called for the first scene, `switch` calls it for the next ones.
+        """
+        self.resources.acquire(scene.ASSETS)
+        scene.start()
+
+    def switch(self, old, new, frame_seconds=0.0):
+        """Stops `old` scene, keeps it for reuse and starts `new` one.
+        Assets of `new` and of the scene likely to follow it are acquired
+        before assets of `old` are released, so assets which are needed again
+        soon (e.g. sounds of the game when it's left for the menu) are never evicted.
+
+        Args:
+            old (Scene)
+            new (Scene): None if the game is closed.
+            frame_seconds (float): duration of the frame in which the transition was requested,
+                                   it includes creation of the new scene.
+        """
+        start = time.perf_counter()
+        old.stop()
+        if old.manager is self:
+            self.idle[type(old)] = (old, None)
+        if new is not None:
+            self.show(new)
+            likely = new.get_likely_next()
+            self.pin(likely[0] if likely else None)
+        self.resources.release(old.ASSETS)
+        ms = (frame_seconds + time.perf_counter() - start) * 1000
+
+        record = (type(old).__name__, type(new).__name__ if new else 'None', ms)
+        self.transitions.append(record)
+        if self.verbose:
+            print(f'Transition {record[0]} -> {record[1]}: {ms:.1f} ms.')
+
+    def report(self, file=None):
+        """Prints the slowest and the average duration of every kind of transition.
+        """
+        durations = {}
+        for old, new, ms in self.transitions:
+            durations.setdefault((old, new), []).append(ms)
+
+        print('Scene transitions (frame time including the switch):', file=file)
+        for (old, new), values in sorted(durations.items()):
+            print(
+                f'    {old:>12} -> {new:<12} {len(values):>4} times, '
+                f'avg {sum(values) / len(values):6.1f} ms, max {max(values):6.1f} ms',
+                file=file
+            )
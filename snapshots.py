@@ -0,0 +1,341 @@
+import random
+import struct
+from array import array
+
+import pygame
+
+from constants import EVENT_SPAWN_ENEMY
+
+
+# Order of `MainScene.params` values inside a record.
+# Changing this tuple changes the record layout, so bump `VERSION` as well.
+PARAM_KEYS = (
+    'player_lives',
+    'player_velocity',
+    'player_cooldown',
+    'player_energy',
+    'spawn_timer_min',
+    'spawn_timer_max',
+    'enemy_velocity',
+    'projectile_velocity',
+    'shoot_cost',
+)
+
+VERSION = 2
+
+# Maximum amount of sprites of every kind stored in a record.
+# Extra sprites (which is very unlikely on a 800x600 screen) are not saved.
+MAX_ENEMIES = 64
+MAX_PROJECTILES = 64
+MAX_EXPLOSIONS = 32
+
+# Amount of `short` values which describe a single sprite of every kind
+ENEMY_FIELDS = 4            # x, y, velocity, angle in tenths of a degree
+PROJECTILE_FIELDS = 2       # x, y
+EXPLOSION_FIELDS = 3        # x, y, age in ms
+
+
+class StateSerializer:
+    """Packs the state of `MainScene` into a fixed-size binary record
+    and restores a scene from such a record.
+
+    Record layout (native byte order, standard sizes):
+        header:     version, ticks, score, last shot time,
+                    every value from `PARAM_KEYS`,
+                    player's position and energy,
+                    amount of enemies, projectiles and explosions
+        entities:   array of shorts with room for
+                    `MAX_ENEMIES` enemies, `MAX_PROJECTILES` projectiles
+                    and `MAX_EXPLOSIONS` explosions
+
+    Every record has the same size, so records can be stored
+    one after another in a preallocated buffer (see `RewindBuffer`).
+    Sprites themselves are never pickled, only numbers which describe them.
+    """
+    header = struct.Struct('=BIii' + 'h' * len(PARAM_KEYS) + 'hhh' + 'BBB')
+
+    enemies_offset = 0
+    projectiles_offset = enemies_offset + MAX_ENEMIES * ENEMY_FIELDS
+    explosions_offset = projectiles_offset + MAX_PROJECTILES * PROJECTILE_FIELDS
+    entity_count = explosions_offset + MAX_EXPLOSIONS * EXPLOSION_FIELDS
+
+    def __init__(self):
+        # Scratch array is reused for every record to avoid allocations in the main loop
+        self.entities = array('h', bytes(self.entity_count * 2))
+        self.entities_size = self.entity_count * self.entities.itemsize
+        self.size = self.header.size + self.entities_size
+
+    def pack_into(self, buffer, offset, scene):
+        """Writes a record describing `scene` into `buffer`.
+
+        Args:
+            buffer (bytearray): writable buffer with at least `offset + size` bytes.
+            offset (int): position of the record inside the buffer.
+            scene (MainScene)
+        """
+        sprites = scene.sprites
+        player = scene.player
+        now = pygame.time.get_ticks()
+
+        enemies = sprites.enemies.sprites()[:MAX_ENEMIES]
+        projectiles = sprites.projectiles.sprites()[:MAX_PROJECTILES]
+        explosions = sprites.explosion.sprites()[:MAX_EXPLOSIONS]
+
+        self.header.pack_into(
+            buffer, offset,
+            VERSION, now, scene.score, scene.last_shot_time,
+            *(scene.params[key] for key in PARAM_KEYS),
+            player.rect.x, player.rect.y, player.energy,
+            len(enemies), len(projectiles), len(explosions)
+        )
+
+        entities = self.entities
+        i = self.enemies_offset
+        for enemy in enemies:
+            # Position of the unrotated image, rotation is applied again on restore
+            entities[i] = enemy.rect.x - enemy.offset[0]
+            entities[i + 1] = enemy.rect.y - enemy.offset[1]
+            entities[i + 2] = enemy.velocity
+            entities[i + 3] = round(enemy.angle % 360 * 10)
+            i += ENEMY_FIELDS
+
+        i = self.projectiles_offset
+        for projectile in projectiles:
+            entities[i] = projectile.rect.x
+            entities[i + 1] = projectile.rect.y
+            i += PROJECTILE_FIELDS
+
+        i = self.explosions_offset
+        for explosion in explosions:
+            entities[i] = explosion.rect.x
+            entities[i + 1] = explosion.rect.y
+            entities[i + 2] = min(now - explosion.start_time, 0x7fff)
+            i += EXPLOSION_FIELDS
+
+        # Unused slots keep stale values from previous records,
+        # but they are never read because the header stores amounts of sprites.
+        start = offset + self.header.size
+        buffer[start:start + self.entities_size] = self.entities
+
+    def unpack_into(self, scene, buffer, offset=0):
+        """Restores `scene` from a record stored in `buffer`.
+
+        All timestamps (last shot, explosions) are shifted to the current time,
+        so cooldowns continue exactly where they were saved.
+
+        Args:
+            scene (MainScene)
+            buffer (bytes, bytearray)
+            offset (int): position of the record inside the buffer.
+
+        Raises:
+            ValueError: if record was made by another version of serializer.
+        """
+        values = self.header.unpack_from(buffer, offset)
+        if values[0] != VERSION:
+            raise ValueError(f'Unsupported snapshot version: expected {VERSION}, got {values[0]}.')
+
+        ticks, score, last_shot_time = values[1:4]
+        params = values[4:4 + len(PARAM_KEYS)]
+        player_x, player_y, energy, n_enemies, n_projectiles, n_explosions = values[4 + len(PARAM_KEYS):]
+
+        start = offset + self.header.size
+        entities = array('h')
+        entities.frombytes(buffer[start:start + self.entities_size])
+
+        # Time passed since the snapshot was taken
+        shift = pygame.time.get_ticks() - ticks
+
+        scene.score = score
+        scene.last_shot_time = last_shot_time + shift
+        # `params` dict is shared with every sprite, so it is updated in place
+        scene.params.update(zip(PARAM_KEYS, params))
+
+        scene.player.rect.topleft = (player_x, player_y)
+        scene.player.energy = energy
+
+        sprites = scene.sprites
+        sprites.clear_entities()
+
+        i = self.enemies_offset
+        for _ in range(n_enemies):
+            sprites.restore_enemy((entities[i], entities[i + 1]), entities[i + 2], entities[i + 3] / 10)
+            i += ENEMY_FIELDS
+
+        i = self.projectiles_offset
+        for _ in range(n_projectiles):
+            sprites.restore_projectile((entities[i], entities[i + 1]))
+            i += PROJECTILE_FIELDS
+
+        i = self.explosions_offset
+        for _ in range(n_explosions):
+            sprites.restore_explosion((entities[i], entities[i + 1]), entities[i + 2])
+            i += EXPLOSION_FIELDS
+
+    def dumps(self, scene):
+        """Returns a record describing `scene` as `bytes`.
+        """
+        buffer = bytearray(self.size)
+        self.pack_into(buffer, 0, scene)
+        return bytes(buffer)
+
+    def loads(self, scene, data):
+        """Restores `scene` from a record made by `dumps`.
+        """
+        self.unpack_into(scene, data)
+
+
+class RewindBuffer:
+    """Ring buffer of the most recent `StateSerializer` records.
+
+    Memory is allocated once: `capacity` records of the same size.
+    When the buffer is full, the oldest record is overwritten.
+
+    Example:
+        rewind = RewindBuffer(capacity=180)    # 3 seconds at 60 FPS
+        rewind.push(scene)                      # every frame
+        rewind.step_back(scene)                 # restores previous frame
+    """
+    def __init__(self, capacity=180, serializer=None):
+        """
+        Args:
+            capacity (int): max amount of stored records.
+            serializer (StateSerializer): a new one is created if not passed.
+        """
+        self.serializer = serializer or StateSerializer()
+        self.capacity = capacity
+        self.buffer = bytearray(self.serializer.size * capacity)
+
+        self.head = 0       # Index of the slot for the next record
+        self.count = 0      # Amount of stored records
+        # The newest record was pushed after the last update, so it's the current state
+        self.newest_is_current = False
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        self.newest_is_current = False
+
+    def push(self, scene):
+        """Saves the current state of `scene`, called at the end of every frame.
+        """
+        self.serializer.pack_into(self.buffer, self.head * self.serializer.size, scene)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.newest_is_current = True
+
+    def step_back(self, scene, frames=1):
+        """Restores `scene` to the state saved `frames` frames ago.
+        Restored records (and every newer one) are removed from the buffer.
+
+        Right after `push` the newest record is the current state,
+        so it's skipped: the first step really goes a frame back.
+
+        Args:
+            scene (MainScene)
+            frames (int): how many frames to go back.
+
+        Returns:
+            bool: False if there is no older state and nothing was restored.
+        """
+        skip = 1 if self.newest_is_current else 0
+        if self.count <= skip:
+            return False
+
+        frames = min(frames + skip, self.count)
+        self.head = (self.head - frames) % self.capacity
+        self.count -= frames
+        self.newest_is_current = False
+
+        self.serializer.unpack_into(scene, self.buffer, self.head * self.serializer.size)
+        return True
+
+
+def describe(scene):
+    """Everything `StateSerializer` saves about `scene`, in a comparable form.
+    Times are relative to now, because they are shifted on restore.
+    """
+    sprites = scene.sprites
+    now = pygame.time.get_ticks()
+    return {
+        'score': scene.score,
+        'last_shot_age': now - scene.last_shot_time,
+        'params': {key: scene.params[key] for key in PARAM_KEYS},
+        'player': (scene.player.rect.topleft, scene.player.energy),
+        'enemies': sorted(
+            (enemy.rect.topleft, enemy.rect.size, enemy.velocity, enemy.angle, enemy.spin)
+            for enemy in sprites.enemies
+        ),
+        'projectiles': sorted(projectile.rect.topleft for projectile in sprites.projectiles),
+        'explosions': sorted((explosion.rect.topleft, now - explosion.start_time) for explosion in sprites.explosion),
+    }
+
+
+def check_round_trip(resources, clock, frames=300, seed=0):
+    """Plays a game with a bot, saves it by `dumps` and restores it into another scene by `loads`,
+    then checks that `RewindBuffer` brings the game back to a saved frame.
+    Run it with `python snapshots.py` after changing the record layout.
+
+    Args:
+        resources (ResourceManager)
+        clock (VirtualClock): installed virtual clock.
+        frames (int): frames played before the state is saved.
+        seed (int)
+
+    Raises:
+        AssertionError: if a restored scene differs from the saved one.
+    """
+    # Imported here, because `scenes` imports this module
+    from headless import Bot, step_scene
+    from scenes import MainScene
+
+    random.seed(seed)
+    clock.reset()
+    pygame.event.clear()
+    # Spinning enemies check that rotated sprites are restored where they were
+    params = {'player_lives': 255, 'enemy_spin': 3}
+    scene = MainScene(resources, 1, params)
+    scene.start()
+    bot = Bot()
+    rewind = RewindBuffer(capacity=frames // 2)
+
+    def play(amount):
+        for _ in range(amount):
+            step_scene(scene, bot, clock, 1000 / 60)
+            rewind.push(scene)
+
+    play(frames)
+    # Every kind of sprite must be present
+    scene.sprites.create_enemy()
+    scene.sprites.create_projectile()
+    scene.sprites.create_explosion(scene.player)
+
+    serializer = StateSerializer()
+    saved = describe(scene)
+    copy = MainScene(resources, 1, params)
+    serializer.loads(copy, serializer.dumps(scene))
+    if describe(copy) != saved:
+        raise AssertionError('Scene restored by `loads` differs from the saved one.')
+
+    rewind.push(scene)
+    play(rewind.capacity // 2)
+    rewind.step_back(scene, rewind.capacity // 2)
+    if describe(scene) != saved:
+        raise AssertionError('`RewindBuffer.step_back` restored another state.')
+
+    pygame.time.set_timer(EVENT_SPAWN_ENEMY, 0)
+    pygame.mixer.stop()
+    counts = {kind: len(saved[kind]) for kind in ('enemies', 'projectiles', 'explosions')}
+    print(f'Round trip OK: score {saved["score"]}, {counts}.')
+
+
+if __name__ == '__main__':
+    import headless
+
+    resources = headless.init_headless()
+    clock = headless.VirtualClock()
+    clock.install()
+    check_round_trip(resources, clock)
@@ -0,0 +1,284 @@
+"""Soak test: cycles menu -> game -> final scene for a long time
+and checks that memory doesn't grow.
+
+Scenes are created exactly as in the real game (through `next_scene`),
+the game is played by `headless.Bot` with a virtual clock,
+so an hour of kiosk mode is simulated in a few minutes.
+
+Every `--sample-every` cycles, in the menu (only the prewarmed game should have sprites),
+the script collects garbage and records:
+    * memory allocated by Python (`tracemalloc`)
+    * pixel memory of live surfaces (allocated by SDL, invisible for `tracemalloc`)
+    * garbage collector counters
+    * amount of live objects per type (sprites and surfaces)
+
+The test fails (exit code 1) if memory grew by more than `--max-growth-kb`
+since the first sample after warm-up.
+
+Example:
+    python soak.py --cycles 200 --game-seconds 60 --output soak.jsonl
+    python soak.py --minutes 60
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+import pygame
+
+import headless
+from scenes import MenuScene, MainScene, SceneManager
+
+
+class SoakDriver:
+    """Runs scenes the same way `Game.run_frame` does, but with a bot
+    and simulated key presses instead of a player.
+    """
+    def __init__(self, resources, clock, bot=None, fps=60,
+                 game_seconds=60, final_seconds=5, escape_every=4):
+        """
+        Args:
+            resources (ResourceManager)
+            clock (VirtualClock): installed virtual clock.
+            bot (Bot)
+            fps (int): simulated frame rate.
+            game_seconds (int): a game is ended by setting lives to 0
+                                if the bot survives longer than that.
+            final_seconds (int): how long the final scene is shown.
+            escape_every (int): every N-th game is left by Escape
+                                instead of losing, 0 to disable.
+        """
+        self.resources = resources
+        self.clock = clock
+        self.bot = bot or headless.Bot()
+        self.frame_time = 1000 / fps
+        self.game_frames = game_seconds * fps
+        self.final_frames = final_seconds * fps
+        self.escape_every = escape_every
+        self.screen = pygame.display.get_surface()
+
+        # Scenes are reused and prewarmed as in the game, so leaks of reused scenes are caught too
+        self.scenes = SceneManager(resources)
+        self.scene = self.scenes.get(MenuScene)
+        self.scenes.show(self.scene)
+        self.cycles = 0
+        self.frames = 0
+
+    def step(self):
+        bot = self.bot if isinstance(self.scene, MainScene) else None
+        headless.step_scene(self.scene, bot, self.clock, self.frame_time, self.screen)
+        self.frames += 1
+
+        next_scene = self.scene.next_scene
+        if next_scene is not self.scene:
+            self.scenes.switch(self.scene, next_scene)
+        else:
+            self.scenes.prewarm(self.scene)
+        self.scene = next_scene
+
+    def press(self, key):
+        pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=key))
+        self.step()
+
+    def run_cycle(self):
+        """Menu -> game -> final scene -> menu,
+        or menu -> game -> menu for every `escape_every`-th cycle.
+        """
+        self.cycles += 1
+        self.press(pygame.K_RETURN)
+        if not isinstance(self.scene, MainScene):
+            raise RuntimeError(f'Menu started {type(self.scene).__name__} instead of the game.')
+
+        game = self.scene
+        frames = 0
+        while self.scene is game:
+            if frames == self.game_frames:
+                if self.escape_every and self.cycles % self.escape_every == 0:
+                    self.press(pygame.K_ESCAPE)
+                    self.step()
+                    return
+                game.params['player_lives'] = 0
+            self.step()
+            frames += 1
+
+        for _ in range(self.final_frames):
+            self.step()
+
+        self.press(pygame.K_RETURN)
+        # The menu is shown for a frame, as after a real key press
+        self.step()
+
+
+def count_live_objects():
+    """Counts live sprites by type and live surfaces.
+
+    Surfaces are not tracked by the garbage collector,
+    so they are found among references of tracked objects.
+
+    Returns:
+        Tuple[Counter, int]: amount of objects per type name and pixel memory of surfaces in bytes.
+    """
+    counts = Counter()
+    surfaces = {}
+    for obj in gc.get_objects():
+        if isinstance(obj, pygame.sprite.Sprite):
+            counts[type(obj).__name__] += 1
+        for referent in gc.get_referents(obj):
+            if isinstance(referent, pygame.Surface):
+                surfaces[id(referent)] = referent
+
+    surface_bytes = 0
+    for surface in surfaces.values():
+        # Subsurfaces share pixels with their parent
+        if surface.get_parent() is None:
+            surface_bytes += surface.get_pitch() * surface.get_height()
+
+    counts['Surface'] = len(surfaces)
+    return counts, surface_bytes
+
+
+def take_sample(driver, started):
+    gc.collect()
+    traced, peak = tracemalloc.get_traced_memory()
+    objects, surface_bytes = count_live_objects()
+
+    return {
+        'cycle': driver.cycles,
+        'simulated_minutes': round(driver.frames * driver.frame_time / 60000, 1),
+        'real_seconds': round(time.perf_counter() - started, 1),
+        'traced_kb': round(traced / 1024, 1),
+        'peak_kb': round(peak / 1024, 1),
+        'surface_kb': round(surface_bytes / 1024, 1),
+        'gc_counts': gc.get_count(),
+        'gc_collections': [stats['collections'] for stats in gc.get_stats()],
+        'objects': dict(objects),
+    }
+
+
+def print_sample(sample, baseline):
+    growth = ''
+    if baseline:
+        growth = f'  growth {get_growth(baseline, sample):+.1f} KiB'
+
+    objects = ', '.join(f'{name} {count}' for name, count in sorted(sample['objects'].items()))
+    print(
+        f'cycle {sample["cycle"]:>5}  {sample["simulated_minutes"]:>7.1f} min  '
+        f'python {sample["traced_kb"]:>9.1f} KiB  surfaces {sample["surface_kb"]:>9.1f} KiB{growth}  '
+        f'gc {sample["gc_collections"]}  {objects}'
+    )
+
+
+def get_growth(baseline, sample):
+    """Growth of Python and surface memory in KiB.
+    """
+    return (
+        sample['traced_kb'] - baseline['traced_kb']
+        + sample['surface_kb'] - baseline['surface_kb']
+    )
+
+
+def print_top_allocations(before, after, limit=10):
+    """Prints lines of code which allocated the most memory between 2 snapshots.
+    """
+    print(f'Top {limit} allocation sites since warm-up:')
+    for stat in after.compare_to(before, 'lineno')[:limit]:
+        print(f'    {stat}')
+
+
+def run_soak(cycles=30, minutes=0, game_seconds=60, final_seconds=5, sample_every=5,
+             warmup=2, max_growth_kb=1024, output=None):
+    """
+    Args:
+        cycles (int): amount of menu -> game -> final cycles.
+        minutes (int): if not 0, cycles are repeated for this amount of real time instead.
+        game_seconds (int): max simulated length of a game.
+        final_seconds (int): simulated time spent in the final scene.
+        sample_every (int): cycles between samples.
+        warmup (int): cycles before the baseline sample, caches and lazy resources
+                      are filled during them.
+        max_growth_kb (int): allowed memory growth since the baseline.
+        output (str): if passed, every sample is appended to this JSONL file.
+
+    Returns:
+        bool: True if memory growth is within the limit.
+    """
+    resources = headless.init_headless()
+    clock = headless.VirtualClock()
+    clock.install()
+
+    # 1 frame is enough to find the line which allocated the memory
+    tracemalloc.start(1)
+    started = time.perf_counter()
+    driver = SoakDriver(resources, clock, game_seconds=game_seconds, final_seconds=final_seconds)
+
+    for _ in range(warmup):
+        driver.run_cycle()
+
+    baseline = take_sample(driver, started)
+    baseline_snapshot = tracemalloc.take_snapshot()
+    print_sample(baseline, None)
+    samples = [baseline]
+
+    output_file = open(output, 'a') if output else None
+    deadline = started + minutes * 60 if minutes else None
+    while (time.perf_counter() < deadline) if deadline else (driver.cycles < cycles + warmup):
+        driver.run_cycle()
+
+        if (driver.cycles - warmup) % sample_every == 0:
+            sample = take_sample(driver, started)
+            samples.append(sample)
+            print_sample(sample, baseline)
+            if output_file:
+                output_file.write(json.dumps(sample) + '\n')
+                output_file.flush()
+
+    if output_file:
+        output_file.close()
+
+    final = samples[-1] if samples[-1]['cycle'] == driver.cycles else take_sample(driver, started)
+    growth = get_growth(baseline, final)
+
+    objects = Counter(final['objects'])
+    objects.subtract(baseline['objects'])
+    grown = {name: count for name, count in objects.items() if count}
+
+    print(f'{driver.cycles} cycles, {final["simulated_minutes"]} simulated minutes '
+          f'in {final["real_seconds"]} s.')
+    print(f'Memory growth: {growth:+.1f} KiB (limit {max_growth_kb} KiB), '
+          f'live objects change: {grown or "none"}.')
+
+    if growth > max_growth_kb:
+        print_top_allocations(baseline_snapshot, tracemalloc.take_snapshot())
+        print('FAIL: memory grows.')
+        return False
+
+    print('OK')
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Soak test of scene cycles with memory tracking.')
+    parser.add_argument('--cycles', type=int, default=30, help='menu -> game -> final cycles')
+    parser.add_argument('--minutes', type=float, default=0,
+                        help='run for this amount of real time instead of --cycles')
+    parser.add_argument('--game-seconds', type=int, default=60, help='simulated length limit of a game')
+    parser.add_argument('--final-seconds', type=int, default=5, help='simulated time in the final scene')
+    parser.add_argument('--sample-every', type=int, default=5, help='cycles between memory samples')
+    parser.add_argument('--warmup', type=int, default=2, help='cycles before the baseline sample')
+    parser.add_argument('--max-growth-kb', type=int, default=1024,
+                        help='fail if memory grows by more than this since the baseline')
+    parser.add_argument('--output', help='append samples to this JSONL file')
+    args = parser.parse_args()
+
+    passed = run_soak(
+        args.cycles, args.minutes, args.game_seconds, args.final_seconds,
+        args.sample_every, args.warmup, args.max_growth_kb, args.output
+    )
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == '__main__':
+    main()
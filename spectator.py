@@ -0,0 +1,313 @@
+"""Sharing the game state with other processes (dashboards, bots, spectators).
+
+The game writes positions of every sprite and HUD values
+into a shared memory block after every frame (see `StatePublisher`).
+Any amount of processes can read it (see `StateReader`) at the same time.
+The game never waits for readers and readers never block the game.
+
+Consistency is provided by a sequence counter (seqlock):
+the counter is odd while the game is writing a frame.
+A reader copies the block and checks that the counter was even
+and didn't change during the copy, otherwise it tries again.
+
+Run a spectator window next to the game started with `--publish-state`:
+    python spectator.py
+Several games can publish at once under different names:
+    python Invaders.py --publish-state second
+    python spectator.py second
+"""
+import os
+import struct
+import sys
+import time
+from array import array
+from multiprocessing import resource_tracker, shared_memory
+
+import pygame
+
+from sprites import PLAYER, ENEMY, PROJECTILE, EXPLOSION
+
+
+DEFAULT_NAME = 'invaders_state'
+MAX_ENTITIES = 256
+
+# Kinds of scenes
+MENU_SCENE = 0
+MAIN_SCENE = 1
+FINAL_SCENE = 2
+
+# Sequence counter is separated from the rest of the header,
+# because it's written before and after everything else
+sequence = struct.Struct('=Q')
+# Process id of the game which owns the block, written once
+owner = struct.Struct('=I')
+OWNER_OFFSET = sequence.size
+# frame, scene kind, screen width and height, score, lives, energy, max energy, amount of entities
+header = struct.Struct('=IBHHiiiiH')
+HEADER_OFFSET = OWNER_OFFSET + owner.size
+ENTITIES_OFFSET = HEADER_OFFSET + header.size
+ENTITY_FIELDS = 5           # kind, x, y, width, height
+ENTITIES_SIZE = MAX_ENTITIES * ENTITY_FIELDS * 2
+BLOCK_SIZE = ENTITIES_OFFSET + ENTITIES_SIZE
+
+
+class StatePublisher:
+    """Owns the shared memory block and writes the state of a scene into it.
+
+    Example:
+        publisher = StatePublisher()
+        publisher.publish(scene)    # After every `scene.update()`
+        publisher.close()
+    """
+    def __init__(self, name=DEFAULT_NAME):
+        """
+        Args:
+            name (str): name of the shared memory block, readers use the same name.
+
+        Raises:
+            FileExistsError: if the block is published by another running game.
+        """
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=BLOCK_SIZE)
+        except FileExistsError:
+            existing = attach(name)
+            pid = owner.unpack_from(existing.buf, OWNER_OFFSET)[0]
+            existing.close()
+            if is_running(pid):
+                raise FileExistsError(
+                    f'Game state is already published as `{name}` by process {pid}, '
+                    f'pass another name to --publish-state.'
+                ) from None
+
+            # Left by a game which wasn't closed properly
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.memory = shared_memory.SharedMemory(name, create=True, size=BLOCK_SIZE)
+
+        owner.pack_into(self.memory.buf, OWNER_OFFSET, os.getpid())
+
+        self.sequence = 0
+        self.frame = 0
+        # Scratch array is reused for every frame to avoid allocations in the main loop
+        self.entities = array('h', bytes(ENTITIES_SIZE))
+        self.entities_bytes = memoryview(self.entities).cast('B')
+
+    def publish(self, scene):
+        """Writes positions of every sprite and HUD values of `scene`.
+        Scenes without sprites (menu) are published without entities.
+
+        Args:
+            scene (Scene)
+        """
+        count = 0
+        sprites = getattr(scene, 'sprites', None)
+        if sprites is not None:
+            count = self.fill_entities(sprites)
+
+        player = getattr(scene, 'player', None)
+        params = getattr(scene, 'params', {})
+        width, height = pygame.display.get_window_size()
+
+        buffer = self.memory.buf
+        self.frame += 1
+
+        # Odd counter tells readers that the block is being changed
+        self.sequence += 1
+        sequence.pack_into(buffer, 0, self.sequence)
+
+        header.pack_into(
+            buffer, HEADER_OFFSET,
+            self.frame, get_scene_kind(scene), width, height,
+            getattr(scene, 'score', 0),
+            params.get('player_lives', 0),
+            player.energy if player else 0,
+            player.max_energy if player else 0,
+            count
+        )
+        size = count * ENTITY_FIELDS * 2
+        buffer[ENTITIES_OFFSET:ENTITIES_OFFSET + size] = self.entities_bytes[:size]
+
+        self.sequence += 1
+        sequence.pack_into(buffer, 0, self.sequence)
+
+    def fill_entities(self, sprites):
+        """Writes every sprite of `SpriteManager` into `self.entities`.
+
+        Returns:
+            int: amount of written entities.
+        """
+        entities = self.entities
+        i = 0
+        for kind, group in sprites.groups_by_kind:
+            for sprite in group:
+                if i == MAX_ENTITIES * ENTITY_FIELDS:
+                    return MAX_ENTITIES
+
+                rect = sprite.rect
+                entities[i] = kind
+                entities[i + 1] = rect.x
+                entities[i + 2] = rect.y
+                entities[i + 3] = rect.width
+                entities[i + 4] = rect.height
+                i += ENTITY_FIELDS
+
+        return i // ENTITY_FIELDS
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+def is_running(pid):
+    """Checks whether a process exists, 0 means `unknown owner`.
+    """
+    if pid == 0:
+        return False
+    if sys.platform == 'win32':
+        # Windows destroys a block when its last handle is closed,
+        # so an existing block always belongs to a running process.
+        # Besides, `os.kill` would terminate the process there.
+        return True
+
+    try:
+        os.kill(pid, 0)         # Signal 0 only checks that the process exists
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True             # Exists, but belongs to another user
+
+    return True
+
+
+def get_scene_kind(scene):
+    # Imported here, because `scenes` imports a lot of game modules,
+    # which are not needed by readers
+    from scenes import MainScene, FinalScene
+
+    if isinstance(scene, MainScene):
+        return MAIN_SCENE
+    elif isinstance(scene, FinalScene):
+        return FINAL_SCENE
+
+    return MENU_SCENE
+
+
+class StateReader:
+    """Reads consistent frames published by `StatePublisher` from another process.
+    """
+    def __init__(self, name=DEFAULT_NAME):
+        """
+        Raises:
+            FileNotFoundError: if the game isn't running or wasn't started with `--publish-state`.
+        """
+        self.memory = attach(name)
+        self.last_sequence = None
+
+    def read(self, retries=100):
+        """Returns the latest published frame.
+
+        Returns:
+            dict: `frame`, `scene`, `width`, `height`, `score`, `lives`, `energy`, `max_energy`
+                  and `entities` - list of (kind, x, y, width, height) tuples.
+                  None if a consistent frame couldn't be read in `retries` attempts.
+        """
+        buffer = self.memory.buf
+        for _ in range(retries):
+            before = sequence.unpack_from(buffer, 0)[0]
+            if before & 1:
+                continue        # The game is writing right now
+
+            data = bytes(buffer[:BLOCK_SIZE])
+            if sequence.unpack_from(buffer, 0)[0] == before:
+                self.last_sequence = before
+                return parse_block(data)
+
+        return None
+
+    def has_new_frame(self):
+        return sequence.unpack_from(self.memory.buf, 0)[0] != self.last_sequence
+
+    def close(self):
+        self.memory.close()
+
+
+def attach(name):
+    """Opens an existing shared memory block without taking ownership of it.
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)    # Python 3.13+
+    except TypeError:
+        memory = shared_memory.SharedMemory(name)
+        # Otherwise the block is destroyed when the reader exits
+        resource_tracker.unregister(memory._name, 'shared_memory')
+        return memory
+
+
+def parse_block(data):
+    frame, scene, width, height, score, lives, energy, max_energy, count = header.unpack_from(data, HEADER_OFFSET)
+
+    values = array('h')
+    values.frombytes(data[ENTITIES_OFFSET:ENTITIES_OFFSET + count * ENTITY_FIELDS * 2])
+    entities = [tuple(values[i:i + ENTITY_FIELDS]) for i in range(0, len(values), ENTITY_FIELDS)]
+
+    return {
+        'frame': frame,
+        'scene': scene,
+        'width': width,
+        'height': height,
+        'score': score,
+        'lives': lives,
+        'energy': energy,
+        'max_energy': max_energy,
+        'entities': entities,
+    }
+
+
+def run_spectator(name=DEFAULT_NAME, fps=60):
+    """Shows sprites of the running game as colored rects in a separate window.
+    """
+    colors = {
+        PLAYER: pygame.Color('green'),
+        ENEMY: pygame.Color('red'),
+        PROJECTILE: pygame.Color('yellow'),
+        EXPLOSION: pygame.Color('orange'),
+    }
+
+    reader = StateReader(name)
+    state = reader.read()
+    while state is None:
+        time.sleep(0.01)
+        state = reader.read()
+
+    pygame.display.init()
+    pygame.font.init()
+    screen = pygame.display.set_mode((state['width'], state['height']))
+    pygame.display.set_caption('Space Invaders - spectator')
+    font = pygame.font.SysFont('calibri', 24)
+    clock = pygame.time.Clock()
+
+    while True:
+        clock.tick(fps)
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                reader.close()
+                return
+
+        if reader.has_new_frame():
+            state = reader.read() or state
+
+        screen.fill(pygame.Color('black'))
+        for kind, x, y, width, height in state['entities']:
+            pygame.draw.rect(screen, colors[kind], (x, y, width, height), 1)
+
+        hud = f'Frame: {state["frame"]}  Score: {state["score"]}  Lives: {state["lives"]}  Energy: {state["energy"]}'
+        screen.blit(font.render(hud, True, pygame.Color('white')), (10, 10))
+        pygame.display.update()
+
+
+if __name__ == '__main__':
+    try:
+        run_spectator(*sys.argv[1:2])
+    except FileNotFoundError:
+        print('Game is not running. Start it with `python Invaders.py --publish-state`.')
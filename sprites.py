@@ -2,7 +2,45 @@ import random
 
 import pygame
 
+import metrics
 from constants import EVENT_SPAWN_ENEMY, EVENT_ENEMY_BREACH
+from performance import governor
+
+
+# Kinds of sprites in formats which describe them for other processes:
+# shared memory of `spectator.py` and snapshots of `netcode.py`
+PLAYER = 0
+ENEMY = 1
+PROJECTILE = 2
+EXPLOSION = 3
+
+
+def collide_hierarchy(left, right):
+    """Pixel-perfect collision check, same result as `pygame.sprite.collide_mask`.
+
+    Most of pairs checked by `groupcollide` are far from each other,
+    so they are rejected by comparing rects, without touching masks.
+    Masks are compared only if opaque parts of sprites are close enough
+    (see `resources.CollisionData`).
+    """
+    left_rect = left.rect
+    right_rect = right.rect
+    if not left_rect.colliderect(right_rect):
+        return False
+
+    left_data = left.collision
+    right_data = right.collision
+    left_bounds = left_data.bounds.move(left_rect.x, left_rect.y)
+    if not left_bounds.colliderect(right_data.bounds.move(right_rect.x, right_rect.y)):
+        return False
+
+    xoffset = right_rect.x - left_rect.x
+    yoffset = right_rect.y - left_rect.y
+    block = left_data.BLOCK
+    if not left_data.coarse.overlap(right_data.coarse_dilated, (xoffset // block, yoffset // block)):
+        return False
+
+    return left_data.mask.overlap(right_data.mask, (xoffset, yoffset))
 
 
 class Sprite(pygame.sprite.Sprite):
@@ -25,13 +63,37 @@ class Sprite(pygame.sprite.Sprite):
                 and then passed to every sprite created within that scene.
         """
         super().__init__()
+        self.source = img
         self.image = img.img
         self.mask = img.mask
+        self.collision = img.collision
         self.rect = img.img.get_rect()
+        self.offset = (0, 0)        # Of the current rotated variant, see `rotate`
 
         self.rect.center = pos
         self.params = params
 
+    def rotate(self, angle, scale=1):
+        """Turns the sprite around its center.
+        Uses cached variants of the image (see `resources.Image.get_variant`),
+        so it's cheap enough to be called every frame.
+
+        Args:
+            angle (float): degrees, counterclockwise.
+            scale (float)
+        """
+        variant = self.source.get_variant(angle, scale)
+
+        # Position of the unrotated image stays the same
+        x = self.rect.x - self.offset[0] + variant.offset[0]
+        y = self.rect.y - self.offset[1] + variant.offset[1]
+
+        self.image = variant.img
+        self.mask = variant.mask
+        self.collision = variant.collision
+        self.offset = variant.offset
+        self.rect = self.image.get_rect(topleft=(x, y))
+
 
 class Player(Sprite):
     """Player's ship.
@@ -94,6 +156,9 @@ class Enemy(Sprite):
     def __init__(self, img, pos, params):
         super().__init__(img, pos, params)
         self.velocity = params['enemy_velocity']
+        # Degrees per frame, enemies don't spin unless the parameter is set
+        self.spin = params.get('enemy_spin', 0)
+        self.angle = 0
 
         self.screen_width, self.screen_height = pygame.display.get_window_size()
         if self.rect.left < 0:
@@ -104,10 +169,14 @@ class Enemy(Sprite):
     def update(self):
         if self.rect.bottom < self.screen_height:
             self.rect.y += self.velocity
+            if self.spin:
+                self.angle += self.spin
+                self.rotate(self.angle)
         else:
             self.kill()
             # Emits event to tell scene that this enemy reached bottom screen border.
             pygame.event.post(pygame.event.Event(EVENT_ENEMY_BREACH))
+            metrics.counters.breaches += 1
 
 
 class Explosion(Sprite):
@@ -132,12 +201,30 @@ class SpriteManager:
         self.create_sprite_groups()
 
     def create_sprite_groups(self):
+        # `player_group` contains the local player,
+        # `players` contains every ship, including remote ones in co-op mode (see `netcode.py`).
         self.player_group = pygame.sprite.GroupSingle()
+        self.players = pygame.sprite.Group()
         self.enemies = pygame.sprite.Group()
         self.projectiles = pygame.sprite.Group()
         self.explosion = pygame.sprite.Group()
         self.sprites = pygame.sprite.Group()
 
+        # (kind, group) pairs, in the order sprites are described for other processes
+        self.groups_by_kind = (
+            (PLAYER, self.players),
+            (ENEMY, self.enemies),
+            (PROJECTILE, self.projectiles),
+            (EXPLOSION, self.explosion),
+        )
+
+    def reset(self, params):
+        """Removes every sprite, so the manager can be used for a new game.
+        """
+        self.params = params
+        for group in (self.player_group, self.players, self.enemies, self.projectiles, self.explosion, self.sprites):
+            group.empty()
+
     # This section is about creating instances of game objects (ship, projectiles etc).
     # Methods like `create_X` are not only creating object, but also add them 
     # to the corresponding groups and carry out all the accompanying actions.
@@ -147,26 +234,42 @@ class SpriteManager:
             (self.screen_width / 2, self.screen_height - 30),
             self.params
         )
-        player.add(self.player_group, self.sprites)
+        if not self.player_group:
+            player.add(self.player_group)
+        player.add(self.players, self.sprites)
         return player
 
     def create_enemy(self):
+        """
+        Returns:
+            Enemy: None if the limit of live enemies is reached (see `performance.py`).
+        """
+        max_enemies = governor.max_enemies
+        if max_enemies is not None and len(self.enemies) >= max_enemies:
+            return None
+
         enemy = Enemy(
             self.resources.images['enemy'],
             (random.randint(0, self.screen_width), 0),
             self.params
         )
         enemy.add(self.enemies, self.sprites)
+        metrics.counters.spawns += 1
         return enemy
 
-    def create_projectile(self):
+    def create_projectile(self, player=None):
+        """
+        Args:
+            player (Player): ship which fires, the local player by default.
+        """
+        player = player or self.player_group.sprite
         projectile = Projectile(
             self.resources.images['projectile'],
-            self.player_group.sprite.rect.midtop,
+            player.rect.midtop,
             self.params
         )
         projectile.add(self.projectiles, self.sprites)
-        self.resources.sounds['shot'].play()
+        self.play_sound('shot')
         return projectile
 
     def create_explosion(self, ship):
@@ -175,8 +278,48 @@ class SpriteManager:
             ship.rect.center,
             self.params
         )
-        explosion.add(self.sprites)
-        self.resources.sounds['explosion'].play()
+        explosion.add(self.explosion, self.sprites)
+        self.play_sound('explosion')
+        return explosion
+
+    # This section is used to rebuild sprites from a saved state (see `snapshots.py`).
+    # Unlike `create_X` methods, they don't play any sounds
+    # and place sprites exactly where they were saved.
+    def clear_entities(self):
+        """Removes every enemy, projectile and explosion.
+        Player's ship is kept.
+        """
+        for group in (self.enemies, self.projectiles, self.explosion):
+            for sprite in group.sprites():
+                sprite.kill()
+
+    def restore_enemy(self, topleft, velocity, angle=0):
+        """
+        Args:
+            topleft (Tuple[int]): position of the unrotated image.
+            velocity (int)
+            angle (float): degrees, the enemy keeps spinning from it.
+        """
+        enemy = Enemy(self.resources.images['enemy'], (0, 0), self.params)
+        enemy.rect.topleft = topleft
+        enemy.velocity = velocity
+        if angle:
+            enemy.angle = angle
+            enemy.rotate(angle)
+        enemy.add(self.enemies, self.sprites)
+        return enemy
+
+    def restore_projectile(self, topleft):
+        projectile = Projectile(self.resources.images['projectile'], (0, 0), self.params)
+        projectile.rect.topleft = topleft
+        projectile.add(self.projectiles, self.sprites)
+        return projectile
+
+    def restore_explosion(self, topleft, age):
+        explosion = Explosion(self.resources.images['explosion'], (0, 0), self.params)
+        explosion.rect.topleft = topleft
+        explosion.start_time -= age
+        explosion.add(self.explosion, self.sprites)
         return explosion
 
     # Collisions detection
@@ -185,16 +328,17 @@ class SpriteManager:
         player_damage = 0
 
         collisions = pygame.sprite.groupcollide(
-            self.player_group, 
+            self.players, 
             self.enemies, 
             False, 
             True, 
-            pygame.sprite.collide_mask
+            collide_hierarchy
         )
 
-        if collisions:
-            self.create_explosion(self.player_group.sprite)
-            for enemy in collisions[self.player_group.sprite]:
+        for player, enemies in collisions.items():
+            metrics.counters.collisions += len(enemies)
+            self.create_explosion(player)
+            for enemy in enemies:
                 self.create_explosion(enemy)
                 player_damage += 1
                 score += 1
@@ -209,10 +353,11 @@ class SpriteManager:
             self.enemies, 
             True, 
             True, 
-            pygame.sprite.collide_mask
+            collide_hierarchy
         )
         if collisions:
             for projectile in collisions:
+                metrics.counters.collisions += len(collisions[projectile])
                 for enemy in collisions[projectile]:
                     self.create_explosion(enemy)
                     score += 1
@@ -224,12 +369,21 @@ class SpriteManager:
         self.sprites.update()
 
     def draw(self, surface):
-        self.sprites.draw(surface)
+        if governor.draw_explosions:
+            self.sprites.draw(surface)
+        else:
+            for group in (self.players, self.enemies, self.projectiles):
+                group.draw(surface)
+
+    def play_sound(self, name):
+        if governor.allows_sound(name):
+            self.resources.play_sound(name)
 
     def set_enemy_spawn_timer(self, ms=0):
         if not ms:
             timeout = random.randint(self.params['spawn_timer_min'], self.params['spawn_timer_max'])
         else:
             timeout = ms
+        timeout = int(timeout * governor.spawn_factor)
 
         pygame.time.set_timer(EVENT_SPAWN_ENEMY, timeout)
@@ -0,0 +1,103 @@
+import sys
+import time
+from contextlib import contextmanager
+
+
+class StartupTrace:
+    """Measures how long every step of the game startup takes
+    and when the first frame appears on the screen.
+
+    Trace should be created as early as possible (before importing pygame),
+    because every time is measured from the moment of its creation.
+
+    Example:
+        trace = StartupTrace()
+        import pygame
+        trace.mark('imports')               # Time since the previous mark
+
+        with trace.step('resources'):       # Time of the block
+            resources = ResourceManager()
+
+        trace.first_frame()                 # After the first `display.update()`
+        trace.report()
+    """
+    def __init__(self, budget_ms=1000):
+        """
+        Args:
+            budget_ms (int): desired time to first frame.
+                             `report` warns if startup was slower.
+        """
+        self.budget_ms = budget_ms
+        self.start = self.last = time.perf_counter()
+        self.steps = []                 # List of (name, duration in ms, nesting level)
+        self.level = 0
+        self.time_to_first_frame = None
+
+    def mark(self, name):
+        """Records a step which lasted since the previous mark or step.
+        """
+        now = time.perf_counter()
+        self.steps.append((name, (now - self.last) * 1000, self.level))
+        self.last = now
+
+    @contextmanager
+    def step(self, name):
+        """Records a step which lasts while the `with` block is executed.
+        Steps can be nested, e.g. loading of every asset inside `resources` step.
+        """
+        index = len(self.steps)
+        self.steps.append((name, 0, self.level))
+        self.level += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.last = time.perf_counter()
+            self.level -= 1
+            self.steps[index] = (name, (self.last - start) * 1000, self.level)
+
+    def first_frame(self):
+        """Should be called right after a frame is displayed.
+        Only the first call is recorded.
+
+        Returns:
+            bool: True if it was the first frame.
+        """
+        if self.time_to_first_frame is not None:
+            return False
+
+        self.mark('first frame')
+        self.time_to_first_frame = (self.last - self.start) * 1000
+        return True
+
+    def report(self, file=None):
+        """Prints duration of every step and time to first frame.
+        """
+        file = file or sys.stdout
+
+        print('Startup trace:', file=file)
+        for name, duration, level in self.steps:
+            print(f'{duration:9.1f} ms  {"  " * level}{name}', file=file)
+
+        if self.time_to_first_frame is not None:
+            print(f'Time to first frame: {self.time_to_first_frame:.1f} ms', file=file)
+            if self.time_to_first_frame > self.budget_ms:
+                print(f'Startup is over budget of {self.budget_ms} ms!', file=file)
+
+
+class NullTrace:
+    """Does nothing, used when tracing is not needed.
+    Has the same methods as `StartupTrace`.
+    """
+    def mark(self, name):
+        pass
+
+    @contextmanager
+    def step(self, name):
+        yield
+
+    def first_frame(self):
+        return False
+
+    def report(self, file=None):
+        pass
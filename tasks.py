@@ -0,0 +1,97 @@
+"""Background coroutines for scenes (telemetry, leaderboards, save files etc).
+
+Scenes call `Scene.schedule(coroutine)` and never wait for the result,
+so a slow disk or network never delays `update` or `draw`.
+
+When the game runs with `Game.run_async`, coroutines are executed
+by the same event loop between frames. Blocking code must not be called
+from a coroutine directly, wrap it with `run_in_thread` instead.
+When the game runs with a regular `Game.run`, coroutines are executed
+by an event loop in a background thread.
+"""
+import asyncio
+import threading
+
+
+# Keeps references to running tasks, otherwise they can be garbage collected
+_tasks = set()
+_background_loop = None
+
+
+def schedule(coroutine):
+    """Starts `coroutine` in background and returns immediately.
+
+    Returns:
+        asyncio.Task or concurrent.futures.Future
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+
+    if loop:
+        task = loop.create_task(coroutine)
+    else:
+        task = asyncio.run_coroutine_threadsafe(coroutine, get_background_loop())
+
+    _tasks.add(task)
+    task.add_done_callback(_task_done)
+    return task
+
+
+def run_in_thread(function, *args, **kwargs):
+    """Runs a blocking `function` (e.g. writing a file) in a thread pool.
+
+    Example:
+        self.schedule(tasks.run_in_thread(save_score, path, self.score))
+    """
+    return asyncio.to_thread(function, *args, **kwargs)
+
+
+def get_background_loop():
+    """Event loop in a daemon thread, used when there is no running loop in the main thread.
+    """
+    global _background_loop
+
+    if _background_loop is None:
+        _background_loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=_background_loop.run_forever, daemon=True)
+        thread.start()
+
+    return _background_loop
+
+
+def cancel_all():
+    """Cancels every unfinished task, e.g. when the game is closed.
+    """
+    for task in list(_tasks):
+        task.cancel()
+
+
+def _task_done(task):
+    _tasks.discard(task)
+
+    # Errors of background tasks shouldn't stop the game, but shouldn't be silent either
+    if not task.cancelled() and task.exception():
+        print(f'Background task failed: {task.exception()!r}')
+
+
+async def sleep_until(deadline, spin=0.002):
+    """Sleeps until `deadline` (in `loop.time()` units) while letting other tasks run.
+
+    `asyncio.sleep` can wake up a bit late, so it's used only until
+    `spin` seconds before the deadline. The rest of the time
+    control is returned to the event loop as often as possible.
+
+    Args:
+        deadline (float)
+        spin (float): seconds of precise waiting.
+    """
+    loop = asyncio.get_running_loop()
+
+    delay = deadline - loop.time() - spin
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+    while loop.time() < deadline:
+        await asyncio.sleep(0)
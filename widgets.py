@@ -1,5 +1,7 @@
 import pygame
 
+import metrics
+
 
 class Text:
     """Encapsulates the functionality needed to work with text objects.  
@@ -21,6 +23,7 @@ class Text:
 
         # Creating a surface
         self.surface = font.render(message, True, color)
+        metrics.counters.text_renders += 1
         # Calculating size and position
         self.rect = self.surface.get_rect()
 
@@ -39,6 +42,7 @@ class Text:
             color (Tuple[int], pygame.Color): RGB color
         """
         self.surface = self.font.render(self.message, True, color)
+        metrics.counters.text_renders += 1
 
     def change_message(self, message):
         """Re-renders text with new message.
@@ -47,6 +51,7 @@ class Text:
             message (str)
         """
         self.surface = self.font.render(message, True, self.color)
+        metrics.counters.text_renders += 1
         self.rect.width = self.surface.get_rect().width
         # Don't reassign `self.rect` with `self.obj.get_rect()`,
         # because it will reset position (rect.x, rect.y).
@@ -104,16 +109,26 @@ class Menu:
 
         return self.index
 
+    def select(self, index):
+        """Selects a menu item directly, e.g. when a menu is shown again.
+        """
+        if index != self.index:
+            self.menu_items[self.index].change_color(self.MENU_ITEM_COLOR)
+            self.menu_items[index].change_color(self.SELECTED_MENU_ITEM_COLOR)
+            self.index = index
+
+        return self.index
+
     def draw(self, surface):
         """Draws all text objects of menu.
 
         Args:
             surface (Window)
         """
-        surface.blit(self.header_text.obj, self.header_text.rect)
-        surface.blit(self.action_text.obj, self.action_text.rect)
+        self.header_text.draw(surface)
+        self.action_text.draw(surface)
         for menu_item in self.menu_items:
-            surface.blit(menu_item.obj, menu_item.rect)
+            menu_item.draw(surface)
 
 
 class LabelPanel: